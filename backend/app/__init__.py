@@ -9,16 +9,56 @@ db = SQLAlchemy()
 socketio = SocketIO(cors_allowed_origins="*")
 jwt = JWTManager()
 
-def create_app():
+def create_app(debug=False):
     app = Flask(__name__)
     app.config.from_object(Config)
+    # Set before serving so create_app can tell the debug reloader's watcher apart
+    app.debug = debug
+    
+    # Structured logging for the app's 'chat.*' loggers
+    from app.logs import configure_logging
+    configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'], app.config['LOG_SAMPLE_RATE'])
+    
+    # Fork the bcrypt pool first, while this process has no other threads
+    # or open sockets (presence, the message queue and writers come later)
+    from app.utils import init_password_pool
+    init_password_pool(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE_SIZE'])
     
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     # CORS configuration - allow all origins for LAN access
     CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"]}})
-    socketio.init_app(app, cors_allowed_origins="*", async_mode='threading')
+    # Fast JSON encoding for REST responses and Socket.IO packets
+    from app.fast_json import configure_json
+    socket_json = configure_json(app, app.config['JSON_BACKEND'])
+    socketio_options = {'json': socket_json} if socket_json else {}
+    if app.config['SOCKETIO_SERIALIZER'] == 'msgpack':
+        # Binary packets; the JSON module above then only serves REST responses
+        socketio_options = {'serializer': 'msgpack'}
+    from app.timestamps import configure_timestamps
+    configure_timestamps(app.config['TIMESTAMP_FORMAT'])
+    socketio.init_app(app, cors_allowed_origins="*", async_mode='threading',
+                      message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'], **socketio_options)
+    
+    # Shared presence registry (in-memory unless running several workers)
+    from app.presence import presence, presence_notifier
+    presence.configure(app.config['PRESENCE_BACKEND'], app.config['PRESENCE_REDIS_URL'], app.config['PRESENCE_TTL'])
+    presence_notifier.configure(app, app.config['PRESENCE_COALESCE_MS'])
+    presence.start(presence_notifier)
+    
+    # Batched read-marker writes for mark_read
+    from app.read_state import read_receipts
+    read_receipts.configure(app, app.config['READ_RECEIPT_FLUSH_MS'])
+    
+    # Per-user token buckets for socket events and upload concurrency
+    from app.rate_limit import rate_limiter, upload_slots
+    rate_limiter.configure(app.config['RATE_LIMITS'], app.config['RATE_LIMIT_ENABLED'])
+    upload_slots.configure(app.config['UPLOAD_CONCURRENCY_PER_USER'])
+    
+    # WebRTC signaling: ICE candidates are coalesced per peer
+    from app.calls import ice_batcher
+    ice_batcher.configure(app.config['ICE_BATCH_MS'])
     
     # Create uploads directory
     import os
@@ -26,6 +66,25 @@ def create_app():
     if not os.path.exists(upload_dir):
         os.makedirs(upload_dir)
     
+    # Abandoned chunked uploads are swept after this long without activity
+    from app.storage import chunked_uploads
+    chunked_uploads.configure(app.config['CHUNKED_UPLOAD_EXPIRY_HOURS'] * 3600)
+    
+    # Background thumbnail/poster generation for uploaded media
+    from app.previews import preview_pipeline
+    preview_pipeline.configure(upload_dir, app.config['PREVIEW_WORKERS'], app.config['PREVIEW_QUEUE_SIZE'],
+                               app.config['PREVIEW_MAX_DIMENSION'], app.config['PREVIEW_CACHE_MAX_BYTES'],
+                               app.config['FFMPEG_PATH'], app.config['FFPROBE_PATH'])
+    
+    # Size the chat membership cache
+    from app.membership import membership_cache
+    membership_cache.configure(app.config['MEMBERSHIP_CACHE_SIZE'], app.config['MEMBERSHIP_CACHE_TTL'])
+    
+    # Replay buffers only see this worker's messages, so they need a single worker
+    from app.replay import replay_buffer
+    replay_buffer.configure(app.config['REPLAY_BUFFER_SIZE'], app.config['REPLAY_MAX_CHATS'],
+                            enabled=app.config['WORKER_COUNT'] == 1)
+    
     # Register routes
     from app.routes import register_routes
     register_routes(app)
@@ -34,9 +93,44 @@ def create_app():
     from app.websocket_handlers import register_socket_handlers
     register_socket_handlers(socketio)
     
+    # Latency histograms, DB/emit counters and GET /metrics
+    if app.config['METRICS_ENABLED']:
+        from app import metrics
+        metrics.init_app(app, db, socketio)
+    
     # Create tables
     with app.app_context():
         db.create_all()
+        
+        # Columns and indexes added to tables that already existed
+        from app.schema import upgrade_schema
+        upgrade_schema()
+        
+        # Full-text index for message search (FTS5 on SQLite, FULLTEXT on MySQL)
+        from app.search import ensure_search_index
+        ensure_search_index()
+        
+        # Build the username index used by the user search box
+        from app.user_directory import user_directory
+        user_directory.configure(app.config['USER_DIRECTORY_REFRESH_SECONDS'],
+                                 app.config['USER_SEARCH_CACHE_TTL'], app.config['USER_SEARCH_CACHE_SIZE'])
+        user_directory.refresh()
+    
+    # Cold storage for old history; one worker runs the periodic archiver
+    from app.archive import message_archiver
+    message_archiver.configure(app, app.config['ARCHIVE_AFTER_DAYS'], app.config['ARCHIVE_BATCH_SIZE'],
+                               app.config['ARCHIVE_SEGMENT_SIZE'], app.config['ARCHIVE_PAUSE_MS'],
+                               app.config['ARCHIVE_INTERVAL_MINUTES'])
+    # Under the debug reloader only the serving child runs it, not the watcher
+    from werkzeug.serving import is_running_from_reloader
+    serving = not app.debug or is_running_from_reloader()
+    if app.config['ARCHIVE_ENABLED'] and app.config['WORKER_INDEX'] == 0 and serving:
+        message_archiver.start()
+    
+    # Start the write-behind message writer when enabled
+    if app.config['MESSAGE_PERSISTENCE'] == 'write_behind':
+        from app.message_writer import message_writer
+        message_writer.start(app)
     
     return app
 
@@ -0,0 +1,244 @@
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from app import db, socketio
+from app.logs import get_logger
+from app.models import Chat, Message, MessageArchive, User
+from app.serializers import message_rows
+
+log = get_logger('archive')
+
+EPOCH = datetime(1970, 1, 1)
+SEGMENT_CACHE_SIZE = 64  # decoded segments kept in memory; they never change
+
+def _encode(rows):
+    """Compress rows as JSON [id, user_id, content, message_type, file_path, created_at µs]"""
+    data = [[row.id, row.user_id, row.content, row.message_type, row.file_path,
+             (row.created_at - EPOCH) // timedelta(microseconds=1) if row.created_at else None]
+            for row in rows]
+    return zlib.compress(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+class SegmentCache:
+    """LRU of decoded archive segments, keyed by segment id"""
+    
+    def __init__(self, size):
+        self.size = size
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, segment_id):
+        with self._lock:
+            rows = self._segments.get(segment_id)
+            if rows is not None:
+                self._segments.move_to_end(segment_id)
+            return rows
+    
+    def put(self, segment_id, rows):
+        with self._lock:
+            self._segments[segment_id] = rows
+            while len(self._segments) > self.size:
+                self._segments.popitem(last=False)
+
+segment_cache = SegmentCache(SEGMENT_CACHE_SIZE)
+
+def _segment(segment_id):
+    rows = segment_cache.get(segment_id)
+    if rows is None:
+        payload = db.session.query(MessageArchive.payload).filter(MessageArchive.id == segment_id).scalar()
+        rows = json.loads(zlib.decompress(payload))
+        segment_cache.put(segment_id, rows)
+    return rows
+
+def archived_rows(chat_id, limit, before_id=None, after_id=None, newest_first=True):
+    """Up to limit archived messages of a chat between the bounds, ordered by id
+    
+    Returns objects shaped like message_rows() results, so they go through
+    serialize_message unchanged.
+    """
+    query = db.session.query(MessageArchive.id).filter(MessageArchive.chat_id == chat_id)
+    if before_id is not None:
+        query = query.filter(MessageArchive.first_message_id < before_id)
+    if after_id is not None:
+        query = query.filter(MessageArchive.last_message_id > after_id)
+    order = MessageArchive.first_message_id.desc() if newest_first else MessageArchive.first_message_id.asc()
+    # Every segment holds at least one message, so limit segments are always enough
+    segment_ids = [row.id for row in query.order_by(order).limit(limit)]
+    
+    picked = []
+    for segment_id in segment_ids:
+        rows = [row for row in _segment(segment_id)
+                if (before_id is None or row[0] < before_id) and (after_id is None or row[0] > after_id)]
+        picked.extend(reversed(rows) if newest_first else rows)
+        if len(picked) >= limit:
+            break
+    picked = picked[:limit]
+    if not picked:
+        return []
+    
+    usernames = dict(db.session.query(User.id, User.username)
+                     .filter(User.id.in_({row[1] for row in picked})).all())
+    return [SimpleNamespace(id=row[0], chat_id=chat_id, user_id=row[1], username=usernames.get(row[1]),
+                            content=row[2], message_type=row[3], file_path=row[4],
+                            created_at=EPOCH + timedelta(microseconds=row[5]) if row[5] is not None else None)
+            for row in picked]
+
+def history_rows(chat_id, limit, before_id=None, after_id=None, newest_first=True):
+    """Up to limit messages of a chat across hot and archived storage, ordered by id
+    
+    Archived ids are all lower than the ids left in messages, so newest
+    first reads the hot table and only falls back to the archive when it
+    runs out; oldest first does the reverse.
+    """
+    query = message_rows().filter(Message.chat_id == chat_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    
+    if newest_first:
+        rows = query.order_by(Message.id.desc()).limit(limit).all()
+        if len(rows) < limit:
+            rows += archived_rows(chat_id, limit - len(rows), before_id=rows[-1].id if rows else before_id,
+                                  after_id=after_id)
+        return rows
+    
+    rows = archived_rows(chat_id, limit, before_id=before_id, after_id=after_id, newest_first=False)
+    if len(rows) < limit:
+        if rows:
+            query = query.filter(Message.id > rows[-1].id)
+        rows += query.order_by(Message.id.asc()).limit(limit - len(rows)).all()
+    return rows
+
+class MessageArchiver:
+    """Moves old messages into compressed per-chat segments in bounded batches
+    
+    Chats are visited in id order. For each chat the oldest messages are
+    taken in id order up to batch_size, stopping at the first one newer
+    than the cutoff, so what is archived is always a prefix of the chat's
+    history. The newest message of a chat always stays in messages, for
+    the chat list preview. Each batch is its own short transaction, with a
+    pause after it, so live inserts are never held up for long. Archived
+    messages keep their file references but leave the full-text index.
+    """
+    
+    def __init__(self):
+        self.app = None
+        self.max_age = timedelta(days=90)
+        self.batch_size = 1000
+        self.segment_size = 500
+        self.pause = 0.2
+        self.interval = 3600
+        self._started = False
+    
+    def configure(self, app, after_days, batch_size, segment_size, pause_ms, interval_minutes):
+        self.app = app
+        self.max_age = timedelta(days=after_days)
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.pause = pause_ms / 1000.0
+        self.interval = interval_minutes * 60
+    
+    def start(self):
+        """Run the archiver periodically in the background"""
+        if self._started:
+            return
+        self._started = True
+        socketio.start_background_task(self._loop)
+    
+    def _loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.run()
+            except Exception:
+                log.exception('archive_run_failed')
+            socketio.sleep(self.interval)
+    
+    def archive_chat_batch(self, chat_id, cutoff):
+        """Archive up to batch_size old messages of one chat; return (messages, segments, bytes)"""
+        newest_id = db.session.query(func.max(Message.id)).filter(Message.chat_id == chat_id).scalar()
+        if newest_id is None:
+            return 0, 0, 0
+        rows = db.session.query(Message.id, Message.user_id, Message.content, Message.message_type,
+                                Message.file_path, Message.created_at) \
+            .filter(Message.chat_id == chat_id, Message.id < newest_id) \
+            .order_by(Message.id.asc()).limit(self.batch_size).all()
+        
+        prefix = []
+        for row in rows:
+            if row.created_at is None or row.created_at >= cutoff:
+                break
+            prefix.append(row)
+        if not prefix:
+            return 0, 0, 0
+        
+        try:
+            segments = []
+            for start in range(0, len(prefix), self.segment_size):
+                chunk = prefix[start:start + self.segment_size]
+                segments.append({
+                    'chat_id': chat_id,
+                    'first_message_id': chunk[0].id,
+                    'last_message_id': chunk[-1].id,
+                    'message_count': len(chunk),
+                    'oldest_created_at': chunk[0].created_at,
+                    'newest_created_at': chunk[-1].created_at,
+                    'payload': _encode(chunk),
+                    'created_at': datetime.utcnow()
+                })
+            db.session.execute(insert(MessageArchive), segments)
+            Message.query.filter(Message.chat_id == chat_id, Message.id >= prefix[0].id,
+                                 Message.id <= prefix[-1].id).delete(synchronize_session=False)
+            db.session.commit()
+        except IntegrityError:
+            # Another archiver stored this prefix first; its rows are already gone
+            db.session.rollback()
+            log.info('archive_batch_conflict', chat_id=chat_id, first_message_id=prefix[0].id)
+            return 0, 0, 0
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(prefix), len(segments), sum(len(segment['payload']) for segment in segments)
+    
+    def run(self, max_batches=None, chat_ids=None, max_age=None):
+        """Archive everything older than max_age (default: the configured age); return totals"""
+        cutoff = datetime.utcnow() - (max_age if max_age is not None else self.max_age)
+        totals = {'chats': 0, 'messages': 0, 'segments': 0, 'bytes': 0, 'batches': 0}
+        
+        last_chat_id = 0
+        while max_batches is None or totals['batches'] < max_batches:
+            query = db.session.query(Chat.id).filter(Chat.id > last_chat_id)
+            if chat_ids:
+                query = query.filter(Chat.id.in_(chat_ids))
+            chat_id = query.order_by(Chat.id.asc()).limit(1).scalar()
+            if chat_id is None:
+                break
+            last_chat_id = chat_id
+            
+            archived_any = False
+            while max_batches is None or totals['batches'] < max_batches:
+                messages, segments, size = self.archive_chat_batch(chat_id, cutoff)
+                if not messages:
+                    break
+                archived_any = True
+                totals['batches'] += 1
+                totals['messages'] += messages
+                totals['segments'] += segments
+                totals['bytes'] += size
+                socketio.sleep(self.pause)
+                if messages < self.batch_size:
+                    break
+            if archived_any:
+                totals['chats'] += 1
+                log.info('chat_archived', chat_id=chat_id, cutoff=cutoff)
+        
+        if totals['messages']:
+            log.info('archive_run', **totals)
+        return totals
+
+message_archiver = MessageArchiver()
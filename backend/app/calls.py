@@ -0,0 +1,135 @@
+import threading
+import time
+from flask_socketio import join_room
+from app import socketio
+from app.membership import membership_cache
+from app.presence import presence
+
+def call_room(chat_id):
+    return f"call_{chat_id}"
+
+class CallSession:
+    """Participants of one chat's call, captured once when the call starts"""
+    
+    def __init__(self, chat_id, participants):
+        self.chat_id = chat_id
+        self.participants = participants  # frozenset of member ids allowed in the call
+        self.joined = set()
+        self.started_at = time.time()
+
+class CallRegistry:
+    """In-memory call sessions keyed by chat id
+    
+    Signaling checks membership against the session instead of the
+    database, and every member's connected devices are put in the
+    call_{chat_id} room so offers and hang-ups go out as one room emit.
+    A worker that has no session for a call (e.g. the call started on
+    another worker) rebuilds it from the membership cache on first use.
+    """
+    
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+    
+    def participants(self, chat_id):
+        """Return who may signal in a chat's call, without opening a session"""
+        with self._lock:
+            session = self._sessions.get(chat_id)
+        if session is not None:
+            return session.participants
+        return membership_cache.participants(chat_id)
+    
+    def _session(self, chat_id):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+        if session is not None:
+            return session
+        
+        # Capture membership once; later signaling checks use this set
+        session = CallSession(chat_id, membership_cache.participants(chat_id))
+        with self._lock:
+            return self._sessions.setdefault(chat_id, session)
+    
+    def start(self, chat_id, caller_id):
+        """Open (or reuse) the call and put every member's devices in its room"""
+        session = self._session(chat_id)
+        room = call_room(chat_id)
+        for member_id in session.participants:
+            for sid in presence.sids(member_id):
+                join_room(room, sid=sid, namespace='/')
+        with self._lock:
+            session.joined.add(caller_id)
+        return session
+    
+    def join(self, chat_id, user_id):
+        session = self._session(chat_id)
+        if user_id not in session.participants:
+            return None
+        with self._lock:
+            session.joined.add(user_id)
+        return session
+    
+    def end(self, chat_id):
+        """Drop the session and close its room; return True if one existed"""
+        with self._lock:
+            session = self._sessions.pop(chat_id, None)
+        socketio.close_room(call_room(chat_id), namespace='/')
+        return session is not None
+    
+    def leave_everywhere(self, user_id):
+        """Remove a user who went offline; return chats whose call is now over"""
+        ended = []
+        with self._lock:
+            for chat_id, session in list(self._sessions.items()):
+                if user_id in session.joined:
+                    session.joined.discard(user_id)
+                    if len(session.joined) < 2:
+                        ended.append(chat_id)
+        return ended
+
+class IceCandidateBatcher:
+    """Coalesce ICE candidates per (chat, sender, target) for a few milliseconds
+    
+    Candidates trickle in one by one during call setup; this turns each
+    burst into a single 'ice_candidates' packet per peer.
+    """
+    
+    def __init__(self):
+        self.window = 0.01
+        self._pending = {}  # {(chat_id, sender_id, target_id): {'candidates': [...], 'skip_sid': sid}}
+        self._scheduled = False
+        self._lock = threading.Lock()
+    
+    def configure(self, window_ms):
+        self.window = window_ms / 1000.0
+    
+    def add(self, chat_id, sender_id, target_id, candidates, skip_sid=None):
+        with self._lock:
+            key = (chat_id, sender_id, target_id)
+            entry = self._pending.setdefault(key, {'candidates': [], 'skip_sid': skip_sid})
+            entry['candidates'].extend(candidates)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        socketio.start_background_task(self._flush_later)
+    
+    def _flush_later(self):
+        socketio.sleep(self.window)
+        self.flush()
+    
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+        
+        for (chat_id, sender_id, target_id), entry in pending.items():
+            payload = {'chat_id': chat_id, 'sender_id': sender_id, 'candidates': entry['candidates']}
+            if target_id is not None:
+                socketio.emit('ice_candidates', payload, room=f"user_{target_id}")
+            else:
+                # No specific peer yet: everyone else in the call
+                socketio.emit('ice_candidates', payload, room=call_room(chat_id), skip_sid=entry['skip_sid'])
+
+call_registry = CallRegistry()
+ice_batcher = IceCandidateBatcher()
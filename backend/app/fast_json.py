@@ -0,0 +1,43 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is used instead
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson
+    
+    Datetimes are passed through to Flask's default hook so they keep
+    the same HTTP-date format as the stdlib provider.
+    """
+    
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+    
+    def dumps(self, obj, **kwargs):
+        option = self.option
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class OrjsonSocketJSON:
+    """json-module stand-in for python-socketio packet encoding"""
+    
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default,
+                            option=OrjsonProvider.option).decode()
+    
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+def configure_json(app, backend):
+    """Install the configured JSON encoder; return the module Socket.IO should use"""
+    if backend == 'orjson' and orjson is not None:
+        app.json = OrjsonProvider(app)
+        return OrjsonSocketJSON
+    return None
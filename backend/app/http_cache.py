@@ -0,0 +1,59 @@
+import hashlib
+from flask import current_app, request
+from sqlalchemy import or_
+from app import db
+from app.models import Chat, ChatParticipant
+
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def advance_last_message(latest):
+    """Move chats.last_message_id forward for {chat_id: newest message id}
+    
+    Runs in the caller's transaction. The guard keeps the column monotonic
+    even when ids from several write-behind workers commit out of order.
+    """
+    for chat_id, message_id in latest.items():
+        Chat.query.filter(Chat.id == chat_id) \
+            .filter(or_(Chat.last_message_id.is_(None), Chat.last_message_id < message_id)) \
+            .update({Chat.last_message_id: message_id}, synchronize_session=False)
+
+def chat_version(chat_id):
+    """Return a chat's last_message_id as its version, or None if it does not exist
+    
+    Participants are fixed when a chat is created, so new messages are the
+    only thing that changes a chat's pages.
+    """
+    row = db.session.query(Chat.last_message_id).filter(Chat.id == chat_id).first()
+    if row is None:
+        return None
+    return str(row.last_message_id or 0)
+
+def chat_list_etag(user_id):
+    """Digest of every per-chat version and read marker behind a user's chat list"""
+    rows = db.session.query(Chat.id, Chat.last_message_id, ChatParticipant.last_read_message_id) \
+        .join(ChatParticipant, ChatParticipant.chat_id == Chat.id) \
+        .filter(ChatParticipant.user_id == user_id) \
+        .order_by(Chat.id) \
+        .all()
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(f"{row.id}:{row.last_message_id or 0}:{row.last_read_message_id or 0};".encode())
+    return digest.hexdigest()
+
+def not_modified(etag, cache_control=REVALIDATE_CACHE_CONTROL):
+    """Return a 304 response if the request's If-None-Match matches etag"""
+    if etag not in request.if_none_match:
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def with_cache_headers(response, etag, cache_control=REVALIDATE_CACHE_CONTROL):
+    """Attach an ETag and Cache-Control to a (response, status) tuple or response"""
+    if isinstance(response, tuple):
+        response = current_app.make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,90 @@
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timezone
+
+class StructuredLogger:
+    """Thin wrapper over a stdlib logger taking an event name plus fields
+    
+        log.info('user_connected', user_id=3, sid=sid)
+    
+    The level check runs before anything is formatted, so disabled debug
+    calls on the hot path cost one method call.
+    """
+    
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+    
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+    
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+    
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+    
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+    
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+    
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+def get_logger(name):
+    return StructuredLogger(f'chat.{name}')
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records below WARNING; warnings and errors always pass"""
+    
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event and the event's fields"""
+    
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """Human readable 'time LEVEL logger event key=value ...' lines"""
+    
+    def format(self, record):
+        fields = ' '.join(f'{key}={value}' for key, value in getattr(record, 'fields', {}).items())
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+def configure_logging(level='INFO', fmt='text', sample_rate=1.0):
+    """Send the app's 'chat.*' loggers to stderr with the given level, format and sampling"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    if sample_rate < 1.0:
+        handler.addFilter(SamplingFilter(sample_rate))
+    
+    root = logging.getLogger('chat')
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
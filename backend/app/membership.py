@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from app import db
+from app.models import ChatParticipant
+
+class MembershipCache:
+    """Bounded LRU cache of chat participant ids with a per-entry TTL
+    
+    Hot socket events check membership on every message; this keeps those
+    checks off the database. Entries are keyed by chat_id and must be
+    invalidated whenever a chat's membership changes. invalidate() only
+    reaches this worker, so a negative is_participant() is always checked
+    against the database: a member added through another worker is never
+    denied, and only positive answers can be served stale.
+    """
+    
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {chat_id: (expires_at, frozenset(user_ids))}
+        self._lock = threading.Lock()
+    
+    def configure(self, max_size, ttl):
+        """Apply sizing from the app config and drop anything cached so far"""
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+    
+    def participants(self, chat_id, refresh=False):
+        """Return the frozenset of user ids participating in a chat
+        
+        With refresh=True the cached entry is skipped and reloaded.
+        """
+        chat_id = _chat_key(chat_id)
+        if chat_id is None:
+            return frozenset()
+        
+        now = time.monotonic()
+        with self._lock:
+            entry = None if refresh else self._entries.get(chat_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(chat_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        rows = db.session.query(ChatParticipant.user_id).filter_by(chat_id=chat_id).all()
+        user_ids = frozenset(row.user_id for row in rows)
+        
+        with self._lock:
+            self._entries[chat_id] = (now + self.ttl, user_ids)
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user_ids
+    
+    def is_participant(self, chat_id, user_id):
+        if user_id in self.participants(chat_id):
+            return True
+        # The cached list may predate this user joining on another worker
+        return user_id in self.participants(chat_id, refresh=True)
+    
+    def other_participants(self, chat_id, user_id):
+        """Return the participant ids of a chat excluding user_id"""
+        return self.participants(chat_id) - {user_id}
+    
+    def invalidate(self, chat_id):
+        chat_id = _chat_key(chat_id)
+        with self._lock:
+            self._entries.pop(chat_id, None)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+def _chat_key(chat_id):
+    """Normalize chat ids from socket payloads, which may arrive as strings"""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return None
+
+membership_cache = MembershipCache()
@@ -0,0 +1,289 @@
+import atexit
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import func, insert
+from app import db
+from app.http_cache import advance_last_message
+from app.logs import get_logger
+from app.models import Message
+from app.read_state import count_unread
+from app.serializers import serialize_message
+from app.storage import add_file_references
+
+_STOP = object()
+log = get_logger('message_writer')
+
+class WriterBusy(Exception):
+    """Raised when the write-behind queue stays full past the enqueue timeout"""
+
+class LocalIdAllocator:
+    """Message ids from an in-process counter; only valid with a single worker"""
+    
+    def __init__(self, last_id):
+        self._last_id = last_id
+        self._lock = threading.Lock()
+    
+    def next(self):
+        with self._lock:
+            self._last_id += 1
+            return self._last_id
+    
+    def last(self):
+        return self._last_id
+    
+    def hold(self, lowest_id):
+        pass
+    
+    def release(self):
+        pass
+    
+    def held(self):
+        return []
+
+class RedisIdAllocator:
+    """Message ids from one INCR counter shared by every worker
+    
+    Keeps ids monotonic across workers, which keyset paging, sync,
+    unread counts and the chat ETags all rely on. The counter is raised
+    to MAX(messages.id) at startup and never lowered.
+    
+    Each worker also publishes the lowest id it has not persisted yet
+    (hold/release), so any worker can tell which ids are settled. A hold
+    older than HOLD_STALE_SECONDS belongs to a dead worker and is ignored.
+    """
+    
+    HOLD_STALE_SECONDS = 300
+    _RAISE_TO = ("local current = tonumber(redis.call('get', KEYS[1]) or '0') "
+                 "if current < tonumber(ARGV[1]) then redis.call('set', KEYS[1], ARGV[1]) end "
+                 "return 1")
+    
+    def __init__(self, url, last_id, key='message_writer:last_id'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for write-behind with several workers')
+        self._redis = redis.Redis.from_url(url)
+        self._key = key
+        self._holds_key = f'{key}:pending'
+        self._worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._redis.eval(self._RAISE_TO, 1, key, last_id)
+    
+    def next(self):
+        return int(self._redis.incr(self._key))
+    
+    def last(self):
+        return int(self._redis.get(self._key) or 0)
+    
+    def hold(self, lowest_id):
+        self._redis.hset(self._holds_key, self._worker_id, f'{lowest_id}:{time.time()}')
+    
+    def release(self):
+        self._redis.hdel(self._holds_key, self._worker_id)
+    
+    def held(self):
+        """Lowest unpersisted id of every live worker"""
+        now = time.time()
+        lows = []
+        for value in self._redis.hvals(self._holds_key):
+            lowest_id, _, since = value.decode().partition(':')
+            if now - float(since) < self.HOLD_STALE_SECONDS:
+                lows.append(int(lowest_id))
+        return lows
+
+class MessageWriter:
+    """Write-behind persistence for chat messages
+    
+    Messages get a server-assigned id and are handed back immediately so they
+    can be broadcast; a background thread persists them with multi-row
+    inserts, one commit per batch. Ids are allocated by the writer (from
+    Redis when several workers run), so every Message insert must go
+    through it, and all workers must use the same persistence mode.
+    """
+    
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._stopping = False
+        self._ids = None
+        self._pending = set()  # ids handed out but not yet persisted (or dropped)
+        self._pending_lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        """True once write-behind is configured, including while it drains on stop
+        
+        Senders must not fall back to autoincrement inserts during shutdown,
+        since queued or broadcast ids would be handed out again; submit()
+        raises WriterBusy instead.
+        """
+        return self._thread is not None
+    
+    def start(self, app):
+        """Seed the id allocator from the table and start the writer thread"""
+        if self._thread is not None:
+            return
+        
+        self.app = app
+        self.batch_size = app.config['MESSAGE_WRITE_BATCH_SIZE']
+        self.linger = app.config['MESSAGE_WRITE_LINGER_MS'] / 1000.0
+        self.enqueue_timeout = app.config['MESSAGE_WRITE_ENQUEUE_TIMEOUT']
+        self._queue = queue.Queue(maxsize=app.config['MESSAGE_WRITE_QUEUE_SIZE'])
+        
+        with app.app_context():
+            last_id = db.session.query(func.max(Message.id)).scalar() or 0
+        
+        if app.config['WORKER_COUNT'] > 1:
+            url = app.config['SOCKETIO_MESSAGE_QUEUE']
+            if not url:
+                raise RuntimeError('MESSAGE_PERSISTENCE=write_behind with several workers needs SOCKETIO_MESSAGE_QUEUE '
+                                   'to allocate message ids')
+            self._ids = RedisIdAllocator(url, last_id)
+        else:
+            self._ids = LocalIdAllocator(last_id)
+        
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+    
+    def submit(self, chat_id, user_id, content=None, message_type='text', file_path=None):
+        """Queue a message for persistence and return its row with id assigned
+        
+        Blocks for at most MESSAGE_WRITE_ENQUEUE_TIMEOUT seconds when the
+        queue is full, then raises WriterBusy so callers can shed load.
+        """
+        if self._stopping:
+            raise WriterBusy('Message writer is shutting down')
+        
+        with self._pending_lock:
+            if not self._pending:
+                # Published before the id exists, so no reader can miss it
+                self._ids.hold(self._ids.last() + 1)
+            message_id = self._ids.next()
+            self._pending.add(message_id)
+        row = {
+            'id': message_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'content': content,
+            'message_type': message_type,
+            'file_path': file_path,
+            'created_at': datetime.utcnow()
+        }
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._settle([message_id])
+            raise WriterBusy('Message queue is full, try again later')
+        return row
+    
+    def settled_id(self):
+        """Highest id below which every message is persisted for good, or None
+        
+        None means write-behind is off and inserts commit before they are
+        visible. Otherwise a page that only spans ids up to this value can
+        no longer gain a message.
+        """
+        if self._ids is None:
+            return None
+        last = self._ids.last()  # read before the holds: later ids are above it
+        lows = self._ids.held()
+        with self._pending_lock:
+            if self._pending:
+                lows.append(min(self._pending))
+        return min(lows) - 1 if lows else last
+    
+    def _settle(self, ids):
+        """Forget ids that were persisted or dropped and republish the lowest pending one"""
+        with self._pending_lock:
+            self._pending.difference_update(ids)
+            try:
+                if self._pending:
+                    self._ids.hold(min(self._pending))
+                else:
+                    self._ids.release()
+            except Exception as e:
+                log.warning('pending_publish_failed', error=str(e))
+    
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+    
+    def stop(self, timeout=30):
+        """Stop accepting messages and drain everything already queued"""
+        if self._thread is None or self._stopping:
+            return
+        self._stopping = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            
+            # Group commit: gather whatever arrives within the linger window
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            self._flush(batch)
+            self._settle(row['id'] for row in batch)
+            if stop:
+                return
+    
+    def _flush(self, batch, attempts=3):
+        """Persist a batch; if it keeps failing, split it so only bad rows are lost
+        
+        Every row here was already broadcast, so a multi-row insert that one
+        row breaks must not take the rest of the batch down with it.
+        """
+        for attempt in range(attempts):
+            with self.app.app_context():
+                try:
+                    db.session.execute(insert(Message), batch)
+                    add_file_references(row['file_path'] for row in batch)
+                    advance_last_message(_latest_ids(batch))
+                    count_unread((row['chat_id'], row['user_id']) for row in batch)
+                    db.session.commit()
+                    return
+                except Exception as e:
+                    db.session.rollback()
+                    log.warning('flush_failed', attempt=attempt + 1, messages=len(batch), error=str(e))
+            if attempt + 1 < attempts:
+                time.sleep(0.1 * (attempt + 1))
+        
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            self._flush(batch[:middle], attempts=1)
+            self._flush(batch[middle:], attempts=1)
+            return
+        log.error('messages_dropped', messages=1, message_id=batch[0]['id'], chat_id=batch[0]['chat_id'])
+
+def _latest_ids(batch):
+    """Return {chat_id: highest message id} for a batch of queued rows"""
+    latest = {}
+    for row in batch:
+        latest[row['chat_id']] = max(latest.get(row['chat_id'], 0), row['id'])
+    return latest
+
+def message_payload(row, username):
+    """Build the same dict Message.to_dict returns from a queued row"""
+    return serialize_message(SimpleNamespace(**row), username)
+
+message_writer = MessageWriter()
@@ -0,0 +1,268 @@
+import bisect
+import threading
+import time
+from functools import wraps
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100, 250, 500, 1000)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for metrics with a fixed set of label names"""
+    
+    kind = 'untyped'
+    
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+    
+    def samples(self, const_labels):
+        """Yield (suffix, label pairs, value) for the text exposition"""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield '', const_labels + tuple(zip(self.labels, key)), value
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket plus +Inf, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+    
+    def samples(self, const_labels):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            pairs = const_labels + tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', pairs + (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', pairs, counts[-1]
+            yield '_count', pairs, cumulative
+
+class Registry:
+    """Holds every metric and renders them in the Prometheus text format"""
+    
+    def __init__(self):
+        self.metrics = []
+        self.const_labels = ()
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, pairs, value in metric.samples(self.const_labels):
+                lines.append(f'{metric.name}{suffix}{_format_labels(pairs)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    'chat_http_request_duration_seconds', 'REST request latency', ('method', 'route', 'status')))
+socket_event_duration = registry.register(Histogram(
+    'chat_socketio_event_duration_seconds', 'Socket.IO event handler latency', ('event',)))
+socket_emits = registry.register(Counter(
+    'chat_socketio_emits_total', 'Socket.IO packets emitted, by event', ('event',)))
+socket_fanout = registry.register(Histogram(
+    'chat_socketio_fanout_recipients', 'Local connections reached by one emit', ('event',), COUNT_BUCKETS))
+socket_connections = registry.register(Gauge(
+    'chat_socketio_connections', 'Open Socket.IO connections on this worker'))
+db_queries = registry.register(Counter(
+    'chat_db_queries_total', 'SQL statements sent to the database'))
+db_queries_per_handler = registry.register(Histogram(
+    'chat_db_queries_per_handler', 'SQL statements per request or event', ('handler',), COUNT_BUCKETS))
+db_commit_duration = registry.register(Histogram(
+    'chat_db_commit_duration_seconds', 'Time spent in each session commit, flush included'))
+db_commit_per_handler = registry.register(Histogram(
+    'chat_db_commit_seconds_per_handler', 'Commit time per request or event that committed', ('handler',)))
+upload_bytes = registry.register(Counter(
+    'chat_upload_bytes_total', 'Bytes received through uploads', ('kind',)))
+rate_limited = registry.register(Counter(
+    'chat_rate_limited_total', 'Requests and events rejected by the per-user rate limiter', ('event',)))
+
+# Per-thread accounting for the request or event being handled
+_scope = threading.local()
+
+def _begin_scope():
+    _scope.active = True
+    _scope.queries = 0
+    _scope.commit_seconds = 0.0
+    _scope.committed = False
+
+def _end_scope(handler):
+    if not getattr(_scope, 'active', False):
+        return
+    _scope.active = False
+    db_queries_per_handler.observe(_scope.queries, handler=handler)
+    if _scope.committed:
+        db_commit_per_handler.observe(_scope.commit_seconds, handler=handler)
+
+def _on_execute(*args):
+    db_queries.inc()
+    if getattr(_scope, 'active', False):
+        _scope.queries += 1
+
+def _before_commit(session):
+    _scope.commit_started = time.perf_counter()
+
+def _after_commit(session):
+    started = getattr(_scope, 'commit_started', None)
+    if started is None:
+        return
+    _scope.commit_started = None
+    elapsed = time.perf_counter() - started
+    db_commit_duration.observe(elapsed)
+    if getattr(_scope, 'active', False):
+        _scope.commit_seconds += elapsed
+        _scope.committed = True
+
+def init_app(app, db, socketio):
+    """Install the request/event hooks and expose GET /metrics
+    
+    Called from create_app after the socket handlers are registered. With
+    several workers each one keeps its own numbers, labelled with its
+    worker index.
+    """
+    if app.config['WORKER_COUNT'] > 1:
+        registry.const_labels = (('worker', str(app.config['WORKER_INDEX'])),)
+    
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _on_execute)
+    event.listen(Session, 'before_commit', _before_commit)
+    event.listen(Session, 'after_commit', _after_commit)
+    
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        _begin_scope()
+    
+    @app.after_request
+    def observe_request(response):
+        _observe_request(response.status_code)
+        return response
+    
+    @app.teardown_request
+    def observe_failed_request(error):
+        # after_request does not run when a view raises
+        _observe_request(500)
+    
+    @app.route('/metrics')
+    def metrics():
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+    
+    _instrument_socketio(socketio.server)
+
+def _observe_request(status):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route,
+                                  status=status)
+    _end_scope(f'{request.method} {route}')
+
+def _instrument_socketio(server):
+    """Wrap the registered event handlers and the server's emit"""
+    for handlers in server.handlers.values():
+        for name, handler in list(handlers.items()):
+            handlers[name] = _timed_handler(name, handler)
+    server.emit = _counted_emit(server, server.emit)
+
+def _timed_handler(name, handler):
+    @wraps(handler)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        _begin_scope()
+        try:
+            result = handler(*args, **kwargs)
+        finally:
+            socket_event_duration.observe(time.perf_counter() - started, event=name)
+            _end_scope(f'socket {name}')
+        if name == 'connect' and result is not False:
+            socket_connections.inc()
+        elif name == 'disconnect':
+            socket_connections.dec()
+        return result
+    return timed
+
+def _room_size(manager, namespace, room):
+    # Only connections held by this worker are visible here
+    try:
+        return len(manager.rooms.get(namespace, {}).get(room, ()))
+    except (AttributeError, TypeError):
+        return 0
+
+def _counted_emit(server, emit):
+    @wraps(emit)
+    def counted(event, *args, **kwargs):
+        socket_emits.inc(event=event)
+        room = kwargs.get('to') or kwargs.get('room')
+        socket_fanout.observe(_room_size(server.manager, kwargs.get('namespace') or '/', room), event=event)
+        return emit(event, *args, **kwargs)
+    return counted
@@ -1,4 +1,6 @@
 from app import db
+from app.previews import preview_url
+from app.timestamps import format_timestamp
 from datetime import datetime
 
 class User(db.Model):
@@ -19,7 +21,7 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': format_timestamp(self.created_at)
         }
 
 class Chat(db.Model):
@@ -30,6 +32,15 @@ class Chat(db.Model):
     name = db.Column(db.String(100), nullable=True)  # Only for groups
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Per-chat version used for HTTP ETags: the newest message id
+    last_message_id = db.Column(db.Integer, nullable=True)
+    
+    # Canonical (min, max) user pair, only set for direct chats
+    direct_user_low_id = db.Column(db.Integer, nullable=True)
+    direct_user_high_id = db.Column(db.Integer, nullable=True)
+    
+    __table_args__ = (db.UniqueConstraint('direct_user_low_id', 'direct_user_high_id', name='unique_direct_pair'),)
+    
     # Relationships
     participants = db.relationship('ChatParticipant', backref='chat', lazy=True, cascade='all, delete-orphan')
     messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan')
@@ -39,7 +50,7 @@ class Chat(db.Model):
             'id': self.id,
             'type': self.type,
             'name': self.name,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': format_timestamp(self.created_at),
             'participants': [p.user.to_dict() for p in self.participants]
         }
         
@@ -50,6 +61,11 @@ class Chat(db.Model):
                 data['other_user'] = other_participant.user.to_dict()
         
         return data
+    
+    @staticmethod
+    def direct_pair(user_a, user_b):
+        """Return the canonical (low, high) key for a direct chat between two users"""
+        return (min(user_a, user_b), max(user_a, user_b))
 
 class ChatParticipant(db.Model):
     __tablename__ = 'chat_participants'
@@ -58,8 +74,12 @@ class ChatParticipant(db.Model):
     chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_read_message_id = db.Column(db.Integer, nullable=True)
+    # Messages from others after the read marker, kept up to date on insert
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
     
-    __table_args__ = (db.UniqueConstraint('chat_id', 'user_id', name='unique_chat_user'),)
+    __table_args__ = (db.UniqueConstraint('chat_id', 'user_id', name='unique_chat_user'),
+                      db.Index('ix_chat_participants_user_id_chat_id', 'user_id', 'chat_id'))
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -72,6 +92,9 @@ class Message(db.Model):
     file_path = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
+    # Keyset pagination walks a chat's history by id
+    __table_args__ = (db.Index('ix_messages_chat_id_id', 'chat_id', 'id'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -81,6 +104,39 @@ class Message(db.Model):
             'content': self.content,
             'message_type': self.message_type,
             'file_path': self.file_path,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'preview_url': preview_url(self.file_path),
+            'created_at': format_timestamp(self.created_at)
         }
 
+
+class MessageArchive(db.Model):
+    """An immutable, compressed segment of a chat's oldest messages
+    
+    Each segment holds a contiguous run of the chat's message ids; every
+    archived id of a chat is lower than any id still in messages.
+    """
+    __tablename__ = 'message_archives'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'), nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    oldest_created_at = db.Column(db.DateTime, nullable=True)
+    newest_created_at = db.Column(db.DateTime, nullable=True)
+    payload = db.Column(db.LargeBinary(length=16777215), nullable=False)  # zlib-compressed JSON rows
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Unique so two archivers racing on the same prefix cannot both insert it
+    __table_args__ = (db.Index('ix_message_archives_chat_id_first_message_id', 'chat_id', 'first_message_id',
+                               unique=True),)
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    filename = db.Column(db.String(255), unique=True, nullable=False)  # '<sha256>.<ext>' under UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Messages whose file_path points here
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
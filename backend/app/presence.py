@@ -0,0 +1,298 @@
+import os
+import socket
+import threading
+from sqlalchemy.orm import aliased
+from app import db, socketio
+from app.logs import get_logger
+from app.models import ChatParticipant
+
+log = get_logger('presence')
+
+class MemoryPresenceBackend:
+    """Presence kept in this process; only valid with a single worker"""
+    
+    def __init__(self):
+        self._users = {}  # {user_id: set(sids)}
+        self._sids = {}   # {sid: user_id}
+        self._lock = threading.Lock()
+    
+    def add(self, user_id, sid):
+        """Register a connection; return True if it is the user's first device"""
+        with self._lock:
+            self._sids[sid] = user_id
+            sids = self._users.setdefault(user_id, set())
+            sids.add(sid)
+            return len(sids) == 1
+    
+    def remove_sid(self, sid):
+        """Forget a connection; return (user_id, True if it was the last device)"""
+        with self._lock:
+            user_id = self._sids.pop(sid, None)
+            if user_id is None:
+                return None, False
+            sids = self._users.get(user_id, set())
+            sids.discard(sid)
+            if sids:
+                return user_id, False
+            self._users.pop(user_id, None)
+            return user_id, True
+    
+    def sids(self, user_id):
+        with self._lock:
+            return list(self._users.get(user_id, ()))
+    
+    def online_user_ids(self):
+        with self._lock:
+            return list(self._users.keys())
+    
+    def filter_online(self, user_ids):
+        with self._lock:
+            return [user_id for user_id in user_ids if user_id in self._users]
+
+class RedisPresenceBackend:
+    """Presence shared by every worker through a Redis-compatible server
+    
+    Each worker records the sids it owns under its own key and keeps a
+    heartbeat key with a TTL alive. When a worker dies without running its
+    disconnect handlers, the heartbeat expires and any live worker removes
+    that worker's sids, so its users do not stay online forever.
+    """
+    
+    # Drops a sid and, only if it was the user's last one, the user from the
+    # online set, in one step so a connect on another worker cannot land in
+    # between; returns the devices left, or -1 if the sid was already gone
+    _REMOVE_SID = ("if redis.call('hdel', KEYS[1], ARGV[1]) == 0 then return -1 end "
+                   "redis.call('srem', KEYS[2], ARGV[1]) "
+                   "redis.call('srem', KEYS[3], ARGV[1]) "
+                   "local devices = redis.call('scard', KEYS[2]) "
+                   "if devices == 0 then redis.call('srem', KEYS[4], ARGV[2]) end "
+                   "return devices")
+    
+    def __init__(self, url, worker_id, ttl=30, prefix='presence'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for PRESENCE_BACKEND=redis')
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._online_key = f'{prefix}:online'
+        self._sids_key = f'{prefix}:sids'
+        self._workers_key = f'{prefix}:workers'
+        self.worker_id = worker_id
+        self.ttl = ttl
+    
+    def _user_key(self, user_id):
+        return f'{self._prefix}:user:{user_id}'
+    
+    def _worker_key(self, worker_id):
+        return f'{self._prefix}:worker:{worker_id}:sids'
+    
+    def _alive_key(self, worker_id):
+        return f'{self._prefix}:worker:{worker_id}:alive'
+    
+    def add(self, user_id, sid):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._sids_key, sid, user_id)
+        pipe.sadd(self._user_key(user_id), sid)
+        pipe.scard(self._user_key(user_id))
+        pipe.sadd(self._online_key, user_id)
+        pipe.sadd(self._worker_key(self.worker_id), sid)
+        device_count = pipe.execute()[2]
+        return device_count == 1
+    
+    def remove_sid(self, sid, worker_id=None):
+        user_id = self._redis.hget(self._sids_key, sid)
+        if user_id is None:
+            return None, False
+        user_id = int(user_id)
+        device_count = self._redis.eval(
+            self._REMOVE_SID, 4, self._sids_key, self._user_key(user_id),
+            self._worker_key(worker_id or self.worker_id), self._online_key, sid, user_id)
+        if device_count < 0:
+            # Another worker (or the reaper) removed this sid first
+            return None, False
+        return user_id, device_count == 0
+    
+    def heartbeat(self):
+        """Mark this worker alive for another ttl seconds"""
+        pipe = self._redis.pipeline()
+        pipe.set(self._alive_key(self.worker_id), 1, ex=self.ttl)
+        pipe.sadd(self._workers_key, self.worker_id)
+        pipe.execute()
+    
+    def reap_dead_workers(self):
+        """Remove the sids of workers whose heartbeat expired; return users now offline"""
+        offline = []
+        for worker_id in self._redis.smembers(self._workers_key):
+            worker_id = worker_id.decode()
+            if worker_id == self.worker_id or self._redis.exists(self._alive_key(worker_id)):
+                continue
+            for sid in self._redis.smembers(self._worker_key(worker_id)):
+                user_id, last_device = self.remove_sid(sid.decode(), worker_id)
+                if last_device:
+                    offline.append(user_id)
+            pipe = self._redis.pipeline()
+            pipe.delete(self._worker_key(worker_id))
+            pipe.srem(self._workers_key, worker_id)
+            pipe.execute()
+        return offline
+    
+    def sids(self, user_id):
+        return [sid.decode() for sid in self._redis.smembers(self._user_key(user_id))]
+    
+    def online_user_ids(self):
+        return [int(user_id) for user_id in self._redis.smembers(self._online_key)]
+    
+    def filter_online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        flags = self._redis.smismember(self._online_key, user_ids)
+        return [user_id for user_id, online in zip(user_ids, flags) if online]
+
+class PresenceRegistry:
+    """Facade over the configured presence backend"""
+    
+    def __init__(self):
+        self.backend = MemoryPresenceBackend()
+        self._heartbeat_started = False
+    
+    def configure(self, backend, url=None, ttl=30):
+        if backend == 'memory':
+            self.backend = MemoryPresenceBackend()
+        elif backend == 'redis':
+            if not url:
+                raise RuntimeError('PRESENCE_REDIS_URL is required for PRESENCE_BACKEND=redis')
+            # Per process, so a tool that builds the app never claims a live worker's sids
+            worker_id = f'{socket.gethostname()}:{os.getpid()}'
+            self.backend = RedisPresenceBackend(url, worker_id, ttl)
+        else:
+            raise ValueError(f'Unknown presence backend: {backend}')
+    
+    def start(self, notifier):
+        """Keep this worker's heartbeat alive and clean up after dead workers
+        
+        Runs a first sweep right away, so a restarted deployment drops the
+        devices its crashed predecessors left behind. Users left with no
+        device are reported to notifier as offline.
+        """
+        if not isinstance(self.backend, RedisPresenceBackend) or self._heartbeat_started:
+            return
+        self._heartbeat_started = True
+        self.backend.heartbeat()
+        self._reap(notifier)
+        socketio.start_background_task(self._heartbeat_loop, notifier)
+    
+    def _heartbeat_loop(self, notifier):
+        while True:
+            socketio.sleep(self.backend.ttl / 3)
+            try:
+                self.backend.heartbeat()
+                self._reap(notifier)
+            except Exception as e:
+                log.warning('presence_heartbeat_failed', error=str(e))
+    
+    def _reap(self, notifier):
+        offline = self.backend.reap_dead_workers()
+        for user_id in offline:
+            notifier.notify(user_id, False)
+        if offline:
+            log.info('presence_reaped', users=len(offline))
+    
+    def add(self, user_id, sid):
+        return self.backend.add(user_id, sid)
+    
+    def remove_sid(self, sid):
+        return self.backend.remove_sid(sid)
+    
+    def sids(self, user_id):
+        """Return the socket ids of every connected device of a user"""
+        return self.backend.sids(user_id)
+    
+    def online_user_ids(self):
+        return self.backend.online_user_ids()
+    
+    def filter_online(self, user_ids):
+        return self.backend.filter_online(user_ids)
+
+def contact_map(user_ids):
+    """Return {user_id: set(contact ids)} for users sharing a chat, in one query"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    
+    subject = aliased(ChatParticipant)
+    contact = aliased(ChatParticipant)
+    rows = db.session.query(subject.user_id, contact.user_id).distinct() \
+        .join(contact, contact.chat_id == subject.chat_id) \
+        .filter(subject.user_id.in_(user_ids)) \
+        .filter(contact.user_id != subject.user_id) \
+        .all()
+    
+    contacts = {user_id: set() for user_id in user_ids}
+    for subject_id, contact_id in rows:
+        contacts[subject_id].add(contact_id)
+    return contacts
+
+def contact_ids(user_id):
+    """Return the ids of every user who shares at least one chat with user_id"""
+    return contact_map([user_id])[user_id]
+
+class PresenceNotifier:
+    """Coalesce online/offline transitions and fan them out to contacts only
+    
+    Transitions are buffered for a short window; a user who drops and
+    reconnects inside it produces no event at all. Each online contact then
+    receives a single presence_update listing every change that concerns it.
+    """
+    
+    def __init__(self):
+        self.app = None
+        self.window = 0.25
+        self._initial = {}  # {user_id: state before the first change in this window}
+        self._current = {}  # {user_id: latest state}
+        self._scheduled = False
+        self._lock = threading.Lock()
+    
+    def configure(self, app, window_ms):
+        self.app = app
+        self.window = window_ms / 1000.0
+    
+    def notify(self, user_id, online):
+        with self._lock:
+            if user_id not in self._initial:
+                self._initial[user_id] = not online
+            self._current[user_id] = online
+            if self._scheduled:
+                return
+            self._scheduled = True
+        socketio.start_background_task(self._flush_later)
+    
+    def _flush_later(self):
+        socketio.sleep(self.window)
+        self.flush()
+    
+    def flush(self):
+        with self._lock:
+            changes = {user_id: online for user_id, online in self._current.items()
+                       if self._initial[user_id] != online}
+            self._initial = {}
+            self._current = {}
+            self._scheduled = False
+        if not changes:
+            return
+        
+        # {recipient_id: {'online': [...], 'offline': [...]}}
+        updates = {}
+        with self.app.app_context():
+            contacts = contact_map(changes.keys())
+            for user_id, online in changes.items():
+                for recipient_id in presence.filter_online(contacts[user_id]):
+                    update = updates.setdefault(recipient_id, {'online': [], 'offline': []})
+                    update['online' if online else 'offline'].append(user_id)
+        
+        for recipient_id, update in updates.items():
+            socketio.emit('presence_update', update, room=f"user_{recipient_id}")
+
+presence = PresenceRegistry()
+presence_notifier = PresenceNotifier()
@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.logs import get_logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images then get no thumbnail
+    Image = None
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+VIDEO_EXTENSIONS = {'mp4'}
+AUDIO_EXTENSIONS = {'mp3', 'wav'}
+
+log = get_logger('previews')
+
+def preview_kind(filename):
+    """Return 'image', 'video', 'audio' or None for an uploaded file name"""
+    if not filename or '.' not in filename:
+        return None
+    extension = filename.rsplit('.', 1)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    if extension in AUDIO_EXTENSIONS:
+        return 'audio'
+    return None
+
+def preview_url(filename):
+    """URL of the thumbnail/poster for a file, or None if it never gets one"""
+    if preview_kind(filename) in ('image', 'video'):
+        return f'/api/files/{filename}/preview'
+    return None
+
+class PreviewPipeline:
+    """Thumbnails, poster frames and durations generated off the request path
+    
+    Results live in UPLOAD_FOLDER/.previews as '<file>.jpg' plus a '<file>.json'
+    sidecar with width/height/duration. The directory is a cache bounded by
+    PREVIEW_CACHE_MAX_BYTES: the least recently served previews are evicted
+    and simply regenerated the next time they are requested.
+    """
+    
+    def __init__(self):
+        self.upload_folder = None
+        self.max_dimension = 320
+        self.max_bytes = 268435456
+        self.queue_size = 256
+        self.ffmpeg = None
+        self.ffprobe = None
+        self._executor = None
+        self._pending = set()  # file names queued or being generated
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+    
+    def configure(self, upload_folder, workers, queue_size, max_dimension, max_bytes, ffmpeg=None, ffprobe=None):
+        self.upload_folder = upload_folder
+        self.queue_size = queue_size
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+        self.ffmpeg = shutil.which(ffmpeg or 'ffmpeg')
+        self.ffprobe = shutil.which(ffprobe or 'ffprobe')
+        os.makedirs(self._dir(), exist_ok=True)
+        self._cache_bytes = sum(entry.stat().st_size for entry in os.scandir(self._dir()) if entry.is_file())
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preview')
+    
+    def _dir(self):
+        return os.path.join(self.upload_folder, '.previews')
+    
+    def _paths(self, filename):
+        base = os.path.join(self._dir(), filename)
+        return f'{base}.jpg', f'{base}.json'
+    
+    def schedule(self, filename):
+        """Queue preview generation; never blocks and never raises
+        
+        Returns False when the file has no preview or the queue is full. A
+        dropped job is not lost: the preview endpoint schedules it again.
+        """
+        if self._executor is None or preview_kind(filename) is None:
+            return False
+        if os.path.exists(self._paths(filename)[1]):
+            return True
+        with self._lock:
+            if filename in self._pending:
+                return True
+            if len(self._pending) >= self.queue_size:
+                return False
+            self._pending.add(filename)
+        self._executor.submit(self._generate, filename)
+        return True
+    
+    def info(self, filename):
+        """Return the stored preview metadata, or None if it is not ready"""
+        _, meta_path = self._paths(filename)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def thumbnail_path(self, filename):
+        """Return the thumbnail path if it exists, marking it recently used"""
+        thumb_path, _ = self._paths(filename)
+        try:
+            os.utime(thumb_path)
+        except OSError:
+            return None
+        return thumb_path
+    
+    def is_pending(self, filename):
+        with self._lock:
+            return filename in self._pending
+    
+    def _generate(self, filename):
+        try:
+            source = os.path.join(self.upload_folder, filename)
+            thumb_path, meta_path = self._paths(filename)
+            kind = preview_kind(filename)
+            meta = {'kind': kind, 'width': None, 'height': None, 'duration': None, 'thumbnail': False}
+            
+            if kind == 'image' and Image is not None:
+                meta['width'], meta['height'] = self._image_thumbnail(source, thumb_path)
+                meta['thumbnail'] = True
+            elif kind in ('video', 'audio'):
+                meta['duration'] = self._probe_duration(source)
+                if kind == 'video':
+                    meta['thumbnail'] = self._poster_frame(source, thumb_path, meta['duration'])
+            
+            # Write the sidecar last: its presence marks the preview as done
+            temp_meta = f'{meta_path}.tmp'
+            with open(temp_meta, 'w') as f:
+                json.dump(meta, f)
+            os.replace(temp_meta, meta_path)
+            
+            added = os.path.getsize(meta_path)
+            if meta['thumbnail']:
+                added += os.path.getsize(thumb_path)
+            self._account(added)
+        except Exception as e:
+            log.warning('preview_failed', filename=filename, error=str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+    
+    def _image_thumbnail(self, source, thumb_path):
+        with Image.open(source) as image:
+            width, height = image.size
+            # For JPEG, decode at a reduced scale instead of full resolution
+            image.draft('RGB', (self.max_dimension, self.max_dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self.max_dimension, self.max_dimension))
+            if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+                # JPEG has no alpha; flatten onto white rather than black
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            temp_path = f'{thumb_path}.tmp'
+            image.save(temp_path, 'JPEG', quality=80, optimize=True)
+        os.replace(temp_path, thumb_path)
+        return width, height
+    
+    def _probe_duration(self, source):
+        if not self.ffprobe:
+            return None
+        result = subprocess.run(
+            [self.ffprobe, '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', source],
+            capture_output=True, text=True, timeout=30)
+        try:
+            return round(float(result.stdout.strip()), 3)
+        except ValueError:
+            return None
+    
+    def _poster_frame(self, source, thumb_path, duration):
+        if not self.ffmpeg:
+            return False
+        # Skip black intro frames when the clip is long enough
+        offset = '1' if duration and duration > 2 else '0'
+        size = self.max_dimension
+        temp_path = f'{thumb_path}.tmp'
+        result = subprocess.run(
+            [self.ffmpeg, '-v', 'error', '-y', '-ss', offset, '-i', source, '-frames:v', '1',
+             '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease', '-f', 'mjpeg', temp_path],
+            capture_output=True, timeout=60)
+        if result.returncode != 0 or not os.path.exists(temp_path):
+            return False
+        os.replace(temp_path, thumb_path)
+        return True
+    
+    def _account(self, added):
+        with self._lock:
+            self._cache_bytes += added
+            if self._cache_bytes <= self.max_bytes:
+                return
+        self._evict()
+    
+    def _evict(self):
+        """Drop least recently used previews until the cache is at 90% of its cap"""
+        entries = {}
+        for entry in os.scandir(self._dir()):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            key = entry.name.rsplit('.', 1)[0]
+            stat = entry.stat()
+            used, size = entries.get(key, (0, 0))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size)
+        
+        total = sum(size for _, size in entries.values())
+        target = self.max_bytes * 0.9
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= target:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        with self._lock:
+            self._cache_bytes = total
+
+preview_pipeline = PreviewPipeline()
@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
+from flask_socketio import emit
+from app.metrics import rate_limited
+
+class RateLimiter:
+    """Token buckets keyed by (user, event), kept in memory
+    
+    Each event has a sustained rate (tokens per second) and a burst size.
+    A check refills the bucket from the time elapsed since its last use,
+    so there is no timer per bucket. Buckets are kept in least recently
+    used order; a bucket idle long enough to be full again is no different
+    from a new one, so checks drop those from the front as they go. That
+    keeps memory bounded by the active users with O(1) amortized work per
+    check. Events without a rule are never limited.
+    """
+    
+    def __init__(self):
+        self.rules = {}  # {event: (tokens per second, burst)}
+        self._buckets = OrderedDict()  # {(user_id, event): [tokens, last refill, seconds to refill fully]}
+        self._lock = threading.Lock()
+    
+    def configure(self, rules, enabled=True):
+        with self._lock:
+            self.rules = dict(rules) if enabled else {}
+            self._buckets.clear()
+    
+    def check(self, user_id, event, cost=1):
+        """Take cost tokens; return 0 if allowed, else seconds until it would be"""
+        rule = self.rules.get(event)
+        if rule is None:
+            return 0
+        rate, burst = rule
+        cost = min(cost, burst)  # an oversized batch drains the bucket instead of never passing
+        now = time.monotonic()
+        key = (user_id, event)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now, burst / rate]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._expire(now)
+            
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0
+            wait = (cost - bucket[0]) / rate
+        rate_limited.inc(event=event)
+        return wait
+    
+    def _expire(self, now):
+        # Only the oldest couple of buckets are looked at per check
+        for _ in range(2):
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket[1] < bucket[2]:
+                return
+            del self._buckets[key]
+
+class ConcurrencyLimiter:
+    """At most `limit` operations in flight per user; no entry once a user has none"""
+    
+    def __init__(self):
+        self.limit = 2
+        self._active = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, limit):
+        self.limit = limit
+    
+    def acquire(self, user_id):
+        with self._lock:
+            count = self._active.get(user_id, 0)
+            if self.limit and count >= self.limit:
+                return False
+            self._active[user_id] = count + 1
+            return True
+    
+    def release(self, user_id):
+        with self._lock:
+            count = self._active.get(user_id, 0) - 1
+            if count > 0:
+                self._active[user_id] = count
+            else:
+                self._active.pop(user_id, None)
+
+def retry_after_header(seconds):
+    return {'Retry-After': str(max(1, math.ceil(seconds)))}
+
+def rate_limit_error(event, retry_after, data=None):
+    """Payload of the 'error' event sent back to a client that is going too fast
+    
+    data echoes the rejected payload so the client can send it again after
+    retry_after instead of losing it.
+    """
+    error = {
+        'message': 'Too many requests, slow down',
+        'code': 'rate_limited',
+        'event': event,
+        'retry': True,
+        'retry_after': round(retry_after, 3)
+    }
+    if data is not None:
+        error['data'] = data
+    return error
+
+def socket_rate_limit(event, echo=False):
+    """Decorator for socket handlers, placed under jwt_required_socket
+    
+    With echo=True a rejected payload is returned in the error so the
+    client can resend it (used for events that carry user content).
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(data, user_id=None):
+            retry_after = rate_limiter.check(user_id, event)
+            if retry_after:
+                emit('error', rate_limit_error(event, retry_after, data if echo else None))
+                return
+            return f(data, user_id=user_id)
+        return wrapped
+    return decorator
+
+def bounded_uploads(f):
+    """Decorator for upload routes, placed under jwt_required: caps uploads in flight per user"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        user_id = get_jwt_identity()
+        if not upload_slots.acquire(user_id):
+            rate_limited.inc(event='upload')
+            return jsonify({'error': 'Too many uploads in progress, try again shortly'}), 429, retry_after_header(1)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            upload_slots.release(user_id)
+    return wrapped
+
+rate_limiter = RateLimiter()
+upload_slots = ConcurrencyLimiter()
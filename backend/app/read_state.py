@@ -0,0 +1,97 @@
+import atexit
+import threading
+from collections import Counter
+from sqlalchemy import func, or_
+from app import db, socketio
+from app.logs import get_logger
+from app.models import Chat, ChatParticipant, Message
+
+log = get_logger('read_state')
+
+def count_unread(messages):
+    """Bump unread_count for everyone but the sender of each new message
+    
+    messages is an iterable of (chat_id, sender_id). Runs in the caller's
+    transaction, one UPDATE per distinct (chat, sender) pair, so counters
+    move together with the inserted rows.
+    """
+    for (chat_id, sender_id), count in Counter(messages).items():
+        ChatParticipant.query.filter(ChatParticipant.chat_id == chat_id, ChatParticipant.user_id != sender_id) \
+            .update({ChatParticipant.unread_count: ChatParticipant.unread_count + count},
+                    synchronize_session=False)
+
+class ReadReceipts:
+    """Coalesce mark_read events and persist them in periodic batches
+    
+    Only the highest message id per (user, chat) is kept between flushes,
+    so scrolling through a chat costs one UPDATE, not one per message. On
+    flush the read marker advances and unread_count is recomputed from the
+    messages after it, which also corrects any drift in the counter. Marked
+    ids are clamped to the chat's last_message_id, so a bogus id cannot pin
+    the marker past messages that do not exist yet.
+    """
+    
+    def __init__(self):
+        self.app = None
+        self.interval = 1.0
+        self._pending = {}  # {(user_id, chat_id): highest read message id}
+        self._scheduled = False
+        self._lock = threading.Lock()
+    
+    def configure(self, app, interval_ms):
+        if self.app is None:
+            atexit.register(self.flush)
+        self.app = app
+        self.interval = interval_ms / 1000.0
+    
+    def mark(self, user_id, chat_id, message_id):
+        key = (user_id, chat_id)
+        with self._lock:
+            if message_id <= self._pending.get(key, 0):
+                return
+            self._pending[key] = message_id
+            if self._scheduled:
+                return
+            self._scheduled = True
+        socketio.start_background_task(self._flush_later)
+    
+    def _flush_later(self):
+        socketio.sleep(self.interval)
+        self.flush()
+    
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+        if not pending or self.app is None:
+            return
+        
+        with self.app.app_context():
+            try:
+                # Ids come from clients: never mark past a chat's newest message
+                newest = dict(db.session.query(Chat.id, Chat.last_message_id)
+                              .filter(Chat.id.in_({chat_id for _, chat_id in pending})).all())
+                pending = {key: min(message_id, newest.get(key[1]) or 0) for key, message_id in pending.items()}
+                pending = {key: message_id for key, message_id in pending.items() if message_id > 0}
+                for (user_id, chat_id), message_id in pending.items():
+                    unread = db.session.query(func.count(Message.id)) \
+                        .filter(Message.chat_id == chat_id, Message.id > message_id, Message.user_id != user_id) \
+                        .scalar_subquery()
+                    ChatParticipant.query.filter(ChatParticipant.chat_id == chat_id, ChatParticipant.user_id == user_id) \
+                        .filter(or_(ChatParticipant.last_read_message_id.is_(None),
+                                    ChatParticipant.last_read_message_id < message_id)) \
+                        .update({ChatParticipant.last_read_message_id: message_id,
+                                 ChatParticipant.unread_count: unread}, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                log.error('read_receipt_flush_failed', receipts=len(pending), error=str(e))
+                return
+        
+        # Other devices of the reader clear their badge; other members may show it as seen
+        for (user_id, chat_id), message_id in pending.items():
+            socketio.emit('read_receipt', {'chat_id': chat_id, 'user_id': user_id, 'message_id': message_id},
+                          room=f"chat_{chat_id}")
+
+read_receipts = ReadReceipts()
@@ -0,0 +1,100 @@
+import bisect
+import threading
+from collections import OrderedDict, deque
+from app.archive import history_rows
+from app.membership import membership_cache
+from app.serializers import serialize_message
+
+class ReplayBuffer:
+    """Bounded per-room ring buffers of recently sent messages
+    
+    Each chat keeps its newest messages, already serialized, plus the id
+    after which the buffer is complete: every message of the chat with a
+    higher id is in it. Clients that reconnect within that window are
+    answered from memory. Anyone further behind falls back to an indexed
+    range query. A worker only sees the messages it sent itself, so with
+    several workers the buffer is bypassed and sync always reads the
+    database.
+    """
+    
+    def __init__(self, size=200, max_chats=10000):
+        self.size = size
+        self.max_chats = max_chats
+        self.enabled = True
+        self._chats = OrderedDict()  # {chat_id: [complete_after_id, deque(messages by id)]}
+        self._lock = threading.Lock()
+    
+    def configure(self, size, max_chats, enabled=True):
+        with self._lock:
+            self.size = size
+            self.max_chats = max_chats
+            self.enabled = enabled
+            self._chats.clear()
+    
+    def record(self, message):
+        """Remember a serialized message that was just broadcast"""
+        if not self.enabled:
+            return
+        chat_id = int(message['chat_id'])
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None:
+                # Earlier messages of this chat all have smaller ids
+                entry = self._chats[chat_id] = [message['id'] - 1, deque()]
+                while len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            self._chats.move_to_end(chat_id)
+            
+            messages = entry[1]
+            if messages and message['id'] < messages[-1]['id']:
+                # Concurrent senders can finish out of order; keep ids sorted
+                ids = [m['id'] for m in messages]
+                messages.insert(bisect.bisect(ids, message['id']), message)
+            else:
+                messages.append(message)
+            while len(messages) > self.size:
+                entry[0] = messages.popleft()['id']
+    
+    def since(self, chat_id, last_seen_id):
+        """Return messages newer than last_seen_id, or None if not covered"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None or last_seen_id < entry[0]:
+                return None
+            return [m for m in entry[1] if m['id'] > last_seen_id]
+
+def sync_chats(user_id, last_seen, max_messages):
+    """Return {chat_id: {'messages': [...], 'truncated': bool}} for a client
+    
+    last_seen maps chat ids to the newest message id the client has. Chats
+    the user is not in are ignored. When more than max_messages were missed
+    only the newest ones are returned and 'truncated' tells the client to
+    reload that chat instead.
+    """
+    result = {}
+    for key, last_seen_id in (last_seen or {}).items():
+        try:
+            chat_id = int(key)
+            last_seen_id = int(last_seen_id or 0)
+        except (TypeError, ValueError):
+            continue
+        if not membership_cache.is_participant(chat_id, user_id):
+            continue
+        
+        messages = replay_buffer.since(chat_id, last_seen_id)
+        if messages is not None and len(messages) <= max_messages:
+            result[chat_id] = {'messages': messages, 'truncated': False}
+            continue
+        
+        # Too far behind for the buffer: index range scan bounded by max_messages
+        rows = history_rows(chat_id, max_messages + 1, after_id=last_seen_id)
+        truncated = len(rows) > max_messages
+        result[chat_id] = {
+            'messages': [serialize_message(row) for row in reversed(rows[:max_messages])],
+            'truncated': truncated
+        }
+    return result
+
+replay_buffer = ReplayBuffer()
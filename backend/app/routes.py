@@ -1,16 +1,76 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify, send_file, send_from_directory
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from app import db
+from flask_socketio import join_room
+from app import db, socketio
+from app.archive import history_rows
 from app.models import User, Chat, ChatParticipant, Message
-from app.utils import hash_password, check_password, save_uploaded_file
+from app.logs import get_logger
+from app.http_cache import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, advance_last_message, chat_version, chat_list_etag, not_modified, with_cache_headers
+from app.membership import membership_cache
+from app.presence import presence
+from app.message_writer import message_writer, message_payload, WriterBusy
+from app.previews import preview_pipeline, preview_kind, preview_url
+from app.rate_limit import bounded_uploads, rate_limiter, retry_after_header
+from app.read_state import count_unread
+from app.replay import replay_buffer, sync_chats
+from app.serializers import CHAT_COLUMNS, serialize_chats, serialize_chat, chat_for_user, serialize_message
+from app.search import search_messages, search_terms, highlight
+from app.storage import chunked_uploads, add_file_references, UploadError
+from app.timestamps import format_timestamp
+from app.user_directory import user_directory
+from app.utils import hash_password, check_password, password_needs_rehash, save_uploaded_file, allowed_file, validate_message, PasswordHasherBusy
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import BadRequest
+from werkzeug.security import safe_join
+import mimetypes
 import os
+import re
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
+log = get_logger('routes')
+
+CONTENT_ADDRESSED_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)?$')
 
 def register_routes(app):
     app.register_blueprint(api_bp)
 
+def _content_hash(filename):
+    """Return the SHA-256 of a content-addressed upload name, or None"""
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    return match.group(1) if match else None
+
+def _find_direct_chat(pair):
+    """Return the direct chat for a canonical (low, high) user pair, if any"""
+    return Chat.query.filter_by(direct_user_low_id=pair[0], direct_user_high_id=pair[1]).first()
+
+def _last_messages(chat_ids):
+    """Return {chat_id: preview} for the newest message of each chat in one query"""
+    if not chat_ids:
+        return {}
+    
+    latest = db.session.query(func.max(Message.id).label('id')) \
+        .filter(Message.chat_id.in_(chat_ids)) \
+        .group_by(Message.chat_id) \
+        .subquery()
+    rows = db.session.query(Message.id, Message.chat_id, Message.user_id, User.username,
+                            Message.content, Message.message_type, Message.created_at) \
+        .join(latest, Message.id == latest.c.id) \
+        .join(User, User.id == Message.user_id) \
+        .all()
+    
+    return {
+        row.chat_id: {
+            'id': row.id,
+            'user_id': row.user_id,
+            'username': row.username,
+            'content': row.content,
+            'message_type': row.message_type,
+            'created_at': format_timestamp(row.created_at)
+        }
+        for row in rows
+    }
+
 @api_bp.route('/register', methods=['POST', 'OPTIONS'])
 def register():
     if request.method == 'OPTIONS':
@@ -20,7 +80,7 @@ def register():
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No data provided'}), 400
-            
+        
         username = data.get('username')
         email = data.get('email')
         password = data.get('password')
@@ -42,6 +102,7 @@ def register():
         )
         db.session.add(user)
         db.session.commit()
+        user_directory.add(user)
         
         # Create access token
         access_token = create_access_token(identity=user.id)
@@ -51,12 +112,12 @@ def register():
             'access_token': access_token,
             'user': user.to_dict()
         }), 201
-        
+    
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
-        print(f"Registration error: {str(e)}")  # Debug log
-        import traceback
-        traceback.print_exc()
+        log.exception('registration_failed')
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
 @api_bp.route('/login', methods=['POST'])
@@ -74,13 +135,20 @@ def login():
         if not user or not check_password(password, user.password_hash):
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        # Upgrade hashes made with an older cost factor while we have the password
+        if password_needs_rehash(user.password_hash):
+            user.password_hash = hash_password(password)
+            db.session.commit()
+        
         access_token = create_access_token(identity=user.id)
         
         return jsonify({
             'access_token': access_token,
             'user': user.to_dict()
         }), 200
-        
+    
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -90,15 +158,32 @@ def get_chats():
     try:
         user_id = get_jwt_identity()
         
-        # Get all chats where user is a participant
-        participants = ChatParticipant.query.filter_by(user_id=user_id).all()
-        chat_ids = [p.chat_id for p in participants]
-        chats = Chat.query.filter(Chat.id.in_(chat_ids)).all()
-        
-        return jsonify({
-            'chats': [chat.to_dict(user_id=user_id) for chat in chats]
-        }), 200
-        
+        # Nothing changed since the client's copy: skip loading the list
+        etag = chat_list_etag(user_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        # Chats the user participates in, with the stored unread counters read
+        # from the same (user_id-indexed) participant rows
+        rows = db.session.query(*CHAT_COLUMNS, ChatParticipant.unread_count) \
+            .join(ChatParticipant, ChatParticipant.chat_id == Chat.id) \
+            .filter(ChatParticipant.user_id == user_id) \
+            .all()
+        chats = serialize_chats(rows)
+        last_messages = _last_messages([chat['id'] for chat in chats])
+        
+        result = []
+        for chat, row in zip(chats, rows):
+            data = chat_for_user(chat, user_id)
+            data['last_message'] = last_messages.get(chat['id'])
+            data['unread_count'] = row.unread_count or 0
+            result.append(data)
+        
+        return with_cache_headers(jsonify({
+            'chats': result
+        }), etag)
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -119,42 +204,64 @@ def create_chat():
             if len(participant_ids) != 1:
                 return jsonify({'error': 'Direct chat must have exactly one other participant'}), 400
             
-            other_user_id = participant_ids[0]
+            other_user_id = int(participant_ids[0])
             if other_user_id == user_id:
                 return jsonify({'error': 'Cannot create direct chat with yourself'}), 400
             
-            # Check if direct chat already exists
-            existing_chats = Chat.query.filter_by(type='direct').all()
-            for chat in existing_chats:
-                participants = [p.user_id for p in chat.participants]
-                if user_id in participants and other_user_id in participants:
-                    return jsonify({
-                        'message': 'Chat already exists',
-                        'chat': chat.to_dict(user_id=user_id)
-                    }), 200
-        
-        # Create chat
-        chat = Chat(type=chat_type, name=name)
-        db.session.add(chat)
-        db.session.flush()
-        
-        # Add current user as participant
-        participant = ChatParticipant(chat_id=chat.id, user_id=user_id)
-        db.session.add(participant)
-        
-        # Add other participants
-        for pid in participant_ids:
-            if pid != user_id:
-                participant = ChatParticipant(chat_id=chat.id, user_id=pid)
-                db.session.add(participant)
-        
-        db.session.commit()
+            # Check if direct chat already exists (single probe on the pair index)
+            pair = Chat.direct_pair(user_id, other_user_id)
+            existing_chat = _find_direct_chat(pair)
+            if existing_chat:
+                return jsonify({
+                    'message': 'Chat already exists',
+                    'chat': chat_for_user(serialize_chat(existing_chat.id), user_id)
+                }), 200
+        else:
+            pair = (None, None)
+        
+        try:
+            # Create chat
+            chat = Chat(type=chat_type, name=name,
+                        direct_user_low_id=pair[0], direct_user_high_id=pair[1])
+            db.session.add(chat)
+            db.session.flush()
+            
+            # Add current user as participant
+            participant = ChatParticipant(chat_id=chat.id, user_id=user_id)
+            db.session.add(participant)
+            
+            # Add other participants
+            for pid in participant_ids:
+                if pid != user_id:
+                    participant = ChatParticipant(chat_id=chat.id, user_id=pid)
+                    db.session.add(participant)
+            
+            db.session.commit()
+            membership_cache.invalidate(chat.id)
+        except IntegrityError:
+            # A concurrent request created the same direct chat first
+            db.session.rollback()
+            existing_chat = _find_direct_chat(pair) if chat_type == 'direct' else None
+            if not existing_chat:
+                raise
+            return jsonify({
+                'message': 'Chat already exists',
+                'chat': chat_for_user(serialize_chat(existing_chat.id), user_id)
+            }), 200
+        
+        # Put the members' connected devices in the new room and tell them about it
+        chat_data = serialize_chat(chat.id)
+        for member_id in membership_cache.participants(chat.id):
+            for sid in presence.sids(member_id):
+                join_room(f"chat_{chat.id}", sid=sid, namespace='/')
+            if member_id != user_id:
+                socketio.emit('chat_added', chat_for_user(chat_data, member_id), room=f"user_{member_id}")
         
         return jsonify({
             'message': 'Chat created successfully',
-            'chat': chat.to_dict(user_id=user_id)
+            'chat': chat_for_user(chat_data, user_id)
         }), 201
-        
+    
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -166,17 +273,109 @@ def get_messages(chat_id):
         user_id = get_jwt_identity()
         
         # Verify user is participant
-        participant = ChatParticipant.query.filter_by(chat_id=chat_id, user_id=user_id).first()
-        if not participant:
+        if not membership_cache.is_participant(chat_id, user_id):
             return jsonify({'error': 'Chat not found or access denied'}), 404
         
-        # Get messages
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at.asc()).all()
-        
-        return jsonify({
-            'messages': [msg.to_dict() for msg in messages]
-        }), 200
+        # Cursor parameters: before_id pages back in history, after_id pages forward
+        from flask import current_app
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+        limit = request.args.get('limit', current_app.config['MESSAGES_PAGE_SIZE'], type=int)
+        
+        if before_id is not None and after_id is not None:
+            return jsonify({'error': 'Use either before_id or after_id, not both'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, current_app.config['MESSAGES_MAX_PAGE_SIZE'])
+        
+        # A before_id page below the writer's settled id only holds history that
+        # can no longer change, so it is cached for good; other pages (including
+        # ones that may still gain a write-behind message) revalidate against
+        # the chat version
+        settled_id = message_writer.settled_id() if before_id is not None else None
+        if before_id is not None and (settled_id is None or before_id - 1 <= settled_id):
+            etag = f"{chat_id}:b{before_id}:{limit}"
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            anchor = f"b{before_id}" if before_id is not None else f"a{after_id or 0}"
+            etag = f"{chat_id}:v{chat_version(chat_id)}:{anchor}:{limit}"
+            cache_control = REVALIDATE_CACHE_CONTROL
+        cached = not_modified(etag, cache_control)
+        if cached:
+            return cached
+        
+        # Get messages (one extra row tells us whether another page exists);
+        # paging back past the hot table continues into archived segments
+        messages = history_rows(chat_id, limit + 1, before_id=before_id, after_id=after_id,
+                                newest_first=after_id is None)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after_id is None:
+            messages.reverse()
+        
+        next_cursor = None
+        if has_more:
+            next_cursor = messages[-1].id if after_id is not None else messages[0].id
+        
+        return with_cache_headers(jsonify({
+            'messages': [serialize_message(msg) for msg in messages],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }), etag, cache_control)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _search_response(terms, chat_id=None, user_id=None):
+    """Run a paginated message search and build the JSON response"""
+    from flask import current_app
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    limit = min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE'])
+    
+    messages = search_messages(terms, chat_id=chat_id, user_id=user_id, before_id=before_id, limit=limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    
+    results = []
+    for msg in messages:
+        result = serialize_message(msg)
+        result['highlight'] = highlight(msg.content, terms)
+        results.append(result)
+    
+    return jsonify({
+        'results': results,
+        'next_cursor': messages[-1].id if has_more else None,
+        'has_more': has_more
+    }), 200
+
+@api_bp.route('/chats/<int:chat_id>/search', methods=['GET'])
+@jwt_required()
+def search_chat(chat_id):
+    """Full-text search inside one chat, newest first; page with before_id"""
+    try:
+        user_id = get_jwt_identity()
+        if not membership_cache.is_participant(chat_id, user_id):
+            return jsonify({'error': 'Chat not found or access denied'}), 404
         
+        terms = search_terms(request.args.get('q'))
+        if not terms:
+            return jsonify({'error': 'q is required'}), 400
+        return _search_response(terms, chat_id=chat_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_all_chats():
+    """Full-text search across every chat the caller participates in"""
+    try:
+        terms = search_terms(request.args.get('q'))
+        if not terms:
+            return jsonify({'error': 'q is required'}), 400
+        return _search_response(terms, user_id=get_jwt_identity())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -187,43 +386,78 @@ def send_message(chat_id):
         user_id = get_jwt_identity()
         
         # Verify user is participant
-        participant = ChatParticipant.query.filter_by(chat_id=chat_id, user_id=user_id).first()
-        if not participant:
+        if not membership_cache.is_participant(chat_id, user_id):
             return jsonify({'error': 'Chat not found or access denied'}), 404
         
+        # Same bucket as the send_message socket event
+        retry_after = rate_limiter.check(user_id, 'send_message')
+        if retry_after:
+            return jsonify({'error': 'Too many messages, slow down', 'retry_after': round(retry_after, 3)}), \
+                429, retry_after_header(retry_after)
+        
         data = request.get_json()
         content = data.get('content')
         message_type = data.get('message_type', 'text')
         file_path = data.get('file_path')
         
-        if message_type == 'text' and not content:
-            return jsonify({'error': 'Message content is required'}), 400
-        
-        if message_type in ['audio', 'file'] and not file_path:
-            return jsonify({'error': 'File path is required for file/audio messages'}), 400
-        
-        # Create message
-        message = Message(
-            chat_id=chat_id,
-            user_id=user_id,
-            content=content,
-            message_type=message_type,
-            file_path=file_path
-        )
-        db.session.add(message)
-        db.session.commit()
-        
+        error = validate_message(content, message_type, file_path)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        if message_writer.enabled:
+            # Ids are assigned by the writer, so REST inserts must go through it too
+            row = message_writer.submit(chat_id, user_id, content, message_type, file_path)
+            message_data = message_payload(row, db.session.get(User, user_id).username)
+        else:
+            # Create message
+            message = Message(
+                chat_id=chat_id,
+                user_id=user_id,
+                content=content,
+                message_type=message_type,
+                file_path=file_path
+            )
+            db.session.add(message)
+            add_file_references([file_path])
+            db.session.flush()
+            advance_last_message({chat_id: message.id})
+            count_unread([(chat_id, user_id)])
+            # Serialize before commit expires the instance and forces a reload
+            message_data = serialize_message(message, db.session.get(User, user_id).username)
+            db.session.commit()
+        
+        replay_buffer.record(message_data)
         return jsonify({
             'message': 'Message sent successfully',
-            'data': message.to_dict()
+            'data': message_data
         }), 201
-        
+    
+    except WriterBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/sync', methods=['POST'])
+@jwt_required()
+def sync():
+    """Return only the messages newer than the client's last seen id per chat"""
+    try:
+        from flask import current_app
+        data = request.get_json() or {}
+        last_seen = data.get('chats') or {}
+        if not isinstance(last_seen, dict):
+            return jsonify({'error': 'chats must map chat ids to message ids'}), 400
+        
+        return jsonify({
+            'chats': sync_chats(get_jwt_identity(), last_seen, current_app.config['SYNC_MAX_MESSAGES'])
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/upload', methods=['POST'])
 @jwt_required()
+@bounded_uploads
 def upload_file():
     try:
         from flask import current_app
@@ -240,32 +474,208 @@ def upload_file():
         if not filename:
             return jsonify({'error': 'Invalid file type'}), 400
         
+        # Thumbnails/posters are generated in the background, never inline
+        preview_pipeline.schedule(filename)
         return jsonify({
             'file_path': filename,
-            'url': f'/api/files/{filename}'
+            'url': f'/api/files/{filename}',
+            'preview_url': preview_url(filename)
         }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads', methods=['POST'])
+@jwt_required()
+def init_chunked_upload():
+    """Start a resumable upload; chunks are then PUT to /uploads/<upload_id>"""
+    try:
+        from flask import current_app
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        filename = data.get('filename')
+        size = data.get('size')
+        
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type'}), 400
+        if size is not None and (not isinstance(size, int) or size < 0 or
+                                 size > current_app.config['CHUNKED_UPLOAD_MAX_SIZE']):
+            return jsonify({'error': 'Invalid file size'}), 400
         
+        upload_id = chunked_uploads.init(current_app.config['UPLOAD_FOLDER'], user_id, filename, size)
+        return jsonify({
+            'upload_id': upload_id,
+            'offset': 0,
+            'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE']
+        }), 201
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_chunked_upload(upload_id):
+    """Report how many bytes were received, so clients can resume"""
+    try:
+        from flask import current_app
+        status = chunked_uploads.status(current_app.config['UPLOAD_FOLDER'], upload_id, get_jwt_identity())
+        return jsonify(status), 200
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@jwt_required()
+@bounded_uploads
+def append_chunked_upload(upload_id):
+    """Append the raw request body at ?offset=N, streaming it to disk"""
+    try:
+        from flask import current_app
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'offset is required'}), 400
+        
+        new_offset = chunked_uploads.append(current_app.config['UPLOAD_FOLDER'], upload_id, get_jwt_identity(),
+                                            offset, request.stream, current_app.config['CHUNKED_UPLOAD_MAX_SIZE'])
+        return jsonify({'upload_id': upload_id, 'offset': new_offset}), 200
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+@bounded_uploads
+def complete_chunked_upload(upload_id):
+    try:
+        from flask import current_app
+        # Whether the bytes were already stored stays server-side: it would tell
+        # this user that someone else uploaded the same file
+        filename, size, sha256, _ = chunked_uploads.complete(
+            current_app.config['UPLOAD_FOLDER'], upload_id, get_jwt_identity())
+        preview_pipeline.schedule(filename)
+        return jsonify({
+            'file_path': filename,
+            'url': f'/api/files/{filename}',
+            'preview_url': preview_url(filename),
+            'size': size,
+            'sha256': sha256
+        }), 200
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/files/<filename>', methods=['GET'])
 @jwt_required()
 def get_file(filename):
     try:
         from flask import current_app
         upload_folder = current_app.config['UPLOAD_FOLDER']
-        return send_from_directory(upload_folder, filename)
+        delivery = current_app.config['FILE_DELIVERY']
+        
+        # Content-addressed files never change: the hash is a strong ETag and
+        # clients may cache them forever; repeat requests skip the disk entirely
+        sha256 = _content_hash(filename)
+        if sha256:
+            if sha256 in request.if_none_match:
+                response = current_app.response_class(status=304)
+                response.set_etag(sha256)
+                response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+                return response
+        
+        if delivery == 'x-accel-redirect':
+            # Authorized here; the front proxy streams the bytes (and handles Range)
+            path = safe_join(upload_folder, filename)
+            if not path or not os.path.isfile(path):
+                return jsonify({'error': 'File not found'}), 404
+            response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = current_app.config['FILE_ACCEL_PREFIX'] + filename
+        else:
+            # Range and If-None-Match are handled by Werkzeug; with USE_X_SENDFILE
+            # the body is replaced by an X-Sendfile header for the proxy
+            response = send_from_directory(upload_folder, filename, etag=sha256 or True)
+        
+        if sha256:
+            response.set_etag(sha256)
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    except Exception as e:
+        return jsonify({'error': 'File not found'}), 404
+
+@api_bp.route('/files/<filename>/preview', methods=['GET'])
+@jwt_required()
+def get_file_preview(filename):
+    """Serve a file's thumbnail or poster frame; 202 while it is being generated"""
+    try:
+        from flask import current_app
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        sha256 = _content_hash(filename)
+        etag = f"{sha256}-{current_app.config['PREVIEW_MAX_DIMENSION']}" if sha256 else None
+        if etag and etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            return response
+        
+        thumb_path = preview_pipeline.thumbnail_path(filename)
+        if thumb_path:
+            response = send_file(os.path.abspath(thumb_path), mimetype='image/jpeg', etag=etag or True)
+            if etag:
+                response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            return response
+        
+        path = safe_join(upload_folder, filename)
+        if not preview_url(filename) or not path or not os.path.isfile(path):
+            return jsonify({'error': 'File not found'}), 404
+        info = preview_pipeline.info(filename)
+        if info is not None:
+            return jsonify({'error': 'No preview available'}), 404
+        
+        # Not generated yet, or evicted from the preview cache
+        preview_pipeline.schedule(filename)
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': 'File not found'}), 404
 
+@api_bp.route('/files/<filename>/preview/info', methods=['GET'])
+@jwt_required()
+def get_file_preview_info(filename):
+    """Return thumbnail dimensions and media duration once they are known"""
+    try:
+        from flask import current_app
+        path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+        if not path or not os.path.isfile(path):
+            return jsonify({'error': 'File not found'}), 404
+        
+        info = preview_pipeline.info(filename)
+        if info is None:
+            if preview_kind(filename) is None:
+                return jsonify({'status': 'unavailable', 'preview_url': None}), 200
+            preview_pipeline.schedule(filename)
+            return jsonify({'status': 'pending', 'preview_url': preview_url(filename)}), 200
+        
+        return jsonify({
+            'status': 'ready',
+            'kind': info['kind'],
+            'width': info['width'],
+            'height': info['height'],
+            'duration': info['duration'],
+            'preview_url': preview_url(filename) if info['thumbnail'] else None
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/users', methods=['GET'])
 @jwt_required()
 def get_users():
     try:
+        # Served from the in-memory directory: no database query per keystroke
         search = request.args.get('search', '')
-        users = User.query.filter(User.username.contains(search)).limit(20).all()
         return jsonify({
-            'users': [user.to_dict() for user in users]
+            'users': user_directory.search(search, limit=20)
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
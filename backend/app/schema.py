@@ -0,0 +1,101 @@
+from sqlalchemy import UniqueConstraint, inspect, text
+from app import db
+from app.logs import get_logger
+
+log = get_logger('schema')
+
+def upgrade_schema():
+    """Bring tables created by an older version up to the current models
+    
+    db.create_all() only creates missing tables, so columns and indexes added
+    to existing tables are created here. Idempotent: it only touches what
+    the inspector reports as missing, and backfills a column in the same
+    run that adds it.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = set()
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column)}"))
+                added.add(f"{table.name}.{column.name}")
+                log.info('column_added', table=table.name, column=column.name)
+    db.session.commit()
+    
+    _backfill(added)
+    
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        names = {index['name'] for index in inspector.get_indexes(table.name)}
+        names |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in names:
+                index.create(db.engine)
+                log.info('index_added', table=table.name, index=index.name)
+        for constraint in table.constraints:
+            # Unique constraints become unique indexes (SQLite cannot ALTER them in)
+            if not isinstance(constraint, UniqueConstraint) or constraint.name in names:
+                continue
+            column_list = ', '.join(column.name for column in constraint.columns)
+            db.session.execute(text(f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({column_list})"))
+            log.info('index_added', table=table.name, index=constraint.name)
+    db.session.commit()
+
+def _column_ddl(column):
+    ddl = f"{column.name} {column.type.compile(dialect=db.engine.dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        ddl += f" DEFAULT {default!r}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    return ddl
+
+def _backfill(added):
+    """Fill newly added columns from the existing data"""
+    if 'chats.last_message_id' in added:
+        db.session.execute(text(
+            "UPDATE chats SET last_message_id = (SELECT MAX(id) FROM messages WHERE messages.chat_id = chats.id)"))
+    
+    if 'chat_participants.last_read_message_id' in added:
+        # History from before read tracking counts as read, so unread_count stays 0
+        db.session.execute(text(
+            "UPDATE chat_participants SET last_read_message_id = "
+            "(SELECT MAX(id) FROM messages WHERE messages.chat_id = chat_participants.chat_id)"))
+    
+    if 'chats.direct_user_low_id' in added:
+        _backfill_direct_pairs()
+    db.session.commit()
+
+def _backfill_direct_pairs():
+    """Set the canonical user pair on existing direct chats
+    
+    When the old code let duplicates in, only the oldest chat of a pair gets
+    the key; the others keep working but are no longer returned for that pair.
+    """
+    rows = db.session.execute(text(
+        "SELECT c.id, p.user_id FROM chats c JOIN chat_participants p ON p.chat_id = c.id "
+        "WHERE c.type = 'direct' ORDER BY c.id")).all()
+    members = {}
+    for chat_id, user_id in rows:
+        members.setdefault(chat_id, set()).add(user_id)
+    
+    seen = set()
+    for chat_id, user_ids in members.items():
+        if len(user_ids) != 2:
+            continue
+        pair = tuple(sorted(user_ids))
+        if pair in seen:
+            log.warning('duplicate_direct_chat', chat_id=chat_id, user_ids=list(pair))
+            continue
+        seen.add(pair)
+        db.session.execute(text("UPDATE chats SET direct_user_low_id = :low, direct_user_high_id = :high WHERE id = :id"),
+                           {'low': pair[0], 'high': pair[1], 'id': chat_id})
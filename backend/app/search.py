@@ -0,0 +1,130 @@
+import html
+import re
+import unicodedata
+from sqlalchemy import text
+from app import db
+from app.models import Message
+from app.serializers import message_rows
+
+TERM = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+SNIPPET_CONTEXT = 40  # characters kept on each side of the first match
+
+def ensure_search_index():
+    """Create the full-text index for messages.content if it is missing
+    
+    SQLite gets an external-content FTS5 table kept in sync by triggers, so
+    every insert path (including multi-row write-behind batches) indexes new
+    rows in the same transaction. MySQL gets an InnoDB FULLTEXT index, which
+    the engine maintains itself.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        _ensure_sqlite_fts()
+    elif dialect == 'mysql':
+        _ensure_mysql_fulltext()
+
+def _ensure_sqlite_fts():
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")).first()
+    if exists:
+        return
+    statements = [
+        "CREATE VIRTUAL TABLE messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+        # Index whatever history existed before the table was created
+        "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def _ensure_mysql_fulltext():
+    exists = db.session.execute(text(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+        "AND table_name = 'messages' AND index_name = 'ft_messages_content'")).first()
+    if exists:
+        return
+    db.session.execute(text("CREATE FULLTEXT INDEX ft_messages_content ON messages (content)"))
+    db.session.commit()
+
+def search_terms(query):
+    """Split a user query into at most MAX_TERMS word tokens"""
+    return TERM.findall(query or '')[:MAX_TERMS]
+
+def search_messages(terms, chat_id=None, user_id=None, before_id=None, limit=20):
+    """Return messages matching every term, newest first
+    
+    Scope is a single chat (chat_id) or every chat user_id participates in.
+    Returns MESSAGE_COLUMNS rows. The last term matches as a prefix so results update while typing.
+    Results are ordered by id, so before_id works as a keyset cursor.
+    """
+    params = {'limit': limit}
+    if chat_id is not None:
+        scope = 'm.chat_id = :chat_id'
+        params['chat_id'] = chat_id
+    else:
+        scope = 'm.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = :user_id)'
+        params['user_id'] = user_id
+    if before_id is not None:
+        scope += ' AND m.id < :before_id'
+        params['before_id'] = before_id
+    
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        params['query'] = ' '.join(f'"{term}"' for term in terms) + '*'
+        sql = ("SELECT m.id FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+               f"WHERE messages_fts MATCH :query AND {scope} ORDER BY messages_fts.rowid DESC LIMIT :limit")
+    elif dialect == 'mysql':
+        params['query'] = ' '.join(f'+{term}' for term in terms) + '*'
+        sql = ("SELECT m.id FROM messages m WHERE MATCH(m.content) AGAINST (:query IN BOOLEAN MODE) "
+               f"AND {scope} ORDER BY m.id DESC LIMIT :limit")
+    else:
+        # No full-text index on this backend; fall back to an unindexed scan
+        clauses = []
+        for index, term in enumerate(terms):
+            clauses.append(f'm.content LIKE :term{index}')
+            params[f'term{index}'] = f'%{term}%'
+        sql = (f"SELECT m.id FROM messages m WHERE {' AND '.join(clauses)} "
+               f"AND {scope} ORDER BY m.id DESC LIMIT :limit")
+    
+    ids = [row.id for row in db.session.execute(text(sql), params)]
+    if not ids:
+        return []
+    rows = message_rows().filter(Message.id.in_(ids)).order_by(Message.id.desc()).all()
+    return rows
+
+def highlight(content, terms):
+    """Return an HTML-escaped snippet of content with matches wrapped in <mark>"""
+    if not content:
+        return ''
+    # Match on accent-folded text, like the index does, then slice the original
+    folded = _fold(content)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(_fold(term)) for term in terms) + r')\w*', re.IGNORECASE)
+    first = pattern.search(folded)
+    start = max(0, first.start() - SNIPPET_CONTEXT) if first else 0
+    end = min(len(content), (first.end() if first else 0) + SNIPPET_CONTEXT * 2)
+    
+    snippet = content[start:end]
+    parts = []
+    position = 0
+    for match in pattern.finditer(folded[start:end]):
+        parts.append(html.escape(snippet[position:match.start()]))
+        parts.append(f'<mark>{html.escape(snippet[match.start():match.end()])}</mark>')
+        position = match.end()
+    parts.append(html.escape(snippet[position:]))
+    
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(content) else ''
+    return prefix + ''.join(parts) + suffix
+
+def _fold(value):
+    """Strip diacritics one character at a time, keeping string offsets intact"""
+    return ''.join(unicodedata.normalize('NFD', char)[0] for char in value)
@@ -0,0 +1,77 @@
+from app import db
+from app.models import User, Chat, ChatParticipant, Message
+from app.previews import preview_url
+from app.timestamps import format_timestamp
+
+# Column-only loads: rows come back as tuples, no ORM objects are hydrated
+MESSAGE_COLUMNS = (Message.id, Message.chat_id, Message.user_id, User.username, Message.content,
+                   Message.message_type, Message.file_path, Message.created_at)
+CHAT_COLUMNS = (Chat.id, Chat.type, Chat.name, Chat.created_at)
+
+def message_rows():
+    """Query of MESSAGE_COLUMNS with the author's username joined in"""
+    return db.session.query(*MESSAGE_COLUMNS).outerjoin(User, User.id == Message.user_id)
+
+def serialize_message(row, username=None):
+    """Build the Message.to_dict shape from a row or an unexpired Message
+    
+    Pass username when row has no username column (e.g. a freshly flushed
+    Message), so nothing has to be lazy loaded.
+    """
+    return {
+        'id': row.id,
+        'chat_id': row.chat_id,
+        'user_id': row.user_id,
+        'username': username if username is not None else row.username,
+        'content': row.content,
+        'message_type': row.message_type,
+        'file_path': row.file_path,
+        'preview_url': preview_url(row.file_path),
+        'created_at': format_timestamp(row.created_at)
+    }
+
+def _user_dict(row):
+    return {
+        'id': row.id,
+        'username': row.username,
+        'email': row.email,
+        'created_at': format_timestamp(row.created_at)
+    }
+
+def serialize_chats(rows):
+    """Build Chat.to_dict shapes (without other_user) for CHAT_COLUMNS rows
+    
+    Participants of every chat are loaded with one joined query.
+    """
+    chat_ids = [row.id for row in rows]
+    participants = {chat_id: [] for chat_id in chat_ids}
+    if chat_ids:
+        members = db.session.query(ChatParticipant.chat_id, User.id, User.username, User.email, User.created_at) \
+            .join(User, User.id == ChatParticipant.user_id) \
+            .filter(ChatParticipant.chat_id.in_(chat_ids)) \
+            .order_by(ChatParticipant.id) \
+            .all()
+        for member in members:
+            participants[member.chat_id].append(_user_dict(member))
+    
+    return [{
+        'id': row.id,
+        'type': row.type,
+        'name': row.name,
+        'created_at': format_timestamp(row.created_at),
+        'participants': participants[row.id]
+    } for row in rows]
+
+def serialize_chat(chat_id):
+    """Serialize a single chat by id, or return None if it does not exist"""
+    chats = serialize_chats(db.session.query(*CHAT_COLUMNS).filter(Chat.id == chat_id).all())
+    return chats[0] if chats else None
+
+def chat_for_user(data, user_id):
+    """Return a copy of a serialized chat with other_user set for direct chats"""
+    data = dict(data)
+    if data['type'] == 'direct':
+        other = next((p for p in data['participants'] if p['id'] != user_id), None)
+        if other:
+            data['other_user'] = other
+    return data
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from app import db
+from app.logs import get_logger
+from app.metrics import upload_bytes
+from app.models import StoredFile
+
+COPY_BUFFER_SIZE = 65536
+log = get_logger('storage')
+
+class UploadError(Exception):
+    """Raised for invalid chunked upload requests; carries an HTTP status"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def _partial_dir(upload_folder):
+    path = os.path.join(upload_folder, '.partial')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _copy_stream(stream, out, hasher, limit=None):
+    """Copy stream into out in fixed-size blocks, hashing as we go"""
+    written = 0
+    while True:
+        block = stream.read(COPY_BUFFER_SIZE)
+        if not block:
+            return written
+        written += len(block)
+        if limit is not None and written > limit:
+            raise UploadError('Upload exceeds the maximum allowed size', 413)
+        hasher.update(block)
+        out.write(block)
+
+def _finalize(temp_path, sha256, size, extension, upload_folder):
+    """Move a hashed temp file into content-addressed storage
+    
+    Returns (filename, deduplicated). If the content is already stored the
+    temp file is discarded and the existing file is reused.
+    """
+    existing = StoredFile.query.filter_by(sha256=sha256).first()
+    if existing:
+        os.remove(temp_path)
+        return existing.filename, True
+    
+    filename = f"{sha256}.{extension}" if extension else sha256
+    os.replace(temp_path, os.path.join(upload_folder, filename))
+    try:
+        db.session.add(StoredFile(sha256=sha256, filename=filename, size=size))
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent upload of the same content won; both wrote identical bytes
+        db.session.rollback()
+        return StoredFile.query.filter_by(sha256=sha256).first().filename, True
+    return filename, False
+
+def store_stream(stream, original_filename, upload_folder):
+    """Stream an upload to disk, hash it and store it once by content"""
+    temp_path = os.path.join(_partial_dir(upload_folder), f"{uuid.uuid4().hex}.tmp")
+    hasher = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as out:
+            size = _copy_stream(stream, out, hasher)
+        upload_bytes.inc(size, kind='direct')
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return _finalize(temp_path, hasher.hexdigest(), size, file_extension(original_filename), upload_folder)
+
+def add_file_references(file_paths, delta=1):
+    """Adjust ref_count for the stored files referenced by messages
+    
+    Runs in the caller's transaction so counts move together with the
+    message rows. Paths that are not content-addressed are ignored.
+    """
+    counts = Counter(path for path in file_paths if path)
+    for filename, count in counts.items():
+        StoredFile.query.filter_by(filename=filename) \
+            .update({StoredFile.ref_count: StoredFile.ref_count + count * delta}, synchronize_session=False)
+
+class ChunkedUploads:
+    """Resumable init/append/complete uploads streamed straight to disk
+    
+    Each upload is a '.part' file plus a small JSON sidecar under
+    UPLOAD_FOLDER/.partial. The running SHA-256 is kept in memory and rebuilt
+    from the partial file if the process restarted mid-upload. Uploads with
+    no activity for `expiry` seconds are swept (files and in-memory state)
+    from init(), at most once every `sweep_interval` seconds.
+    """
+    
+    def __init__(self):
+        self.expiry = 86400
+        self.sweep_interval = 600
+        self._last_sweep = 0
+        self._hashers = {}  # {upload_id: hashlib object matching the .part file}
+        self._locks = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, expiry_seconds, sweep_interval=600):
+        self.expiry = expiry_seconds
+        self.sweep_interval = sweep_interval
+    
+    def _paths(self, upload_folder, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError('Upload not found', 404)
+        base = os.path.join(_partial_dir(upload_folder), upload_id)
+        return f"{base}.part", f"{base}.json"
+    
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+    
+    def _load(self, upload_folder, upload_id, user_id):
+        part_path, meta_path = self._paths(upload_folder, upload_id)
+        if not os.path.exists(meta_path):
+            raise UploadError('Upload not found', 404)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['user_id'] != user_id:
+            raise UploadError('Upload not found', 404)
+        meta['offset'] = os.path.getsize(part_path)
+        return meta, part_path, meta_path
+    
+    def _hasher(self, upload_id, part_path):
+        hasher = self._hashers.get(upload_id)
+        if hasher is None:
+            hasher = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+                    hasher.update(block)
+            self._hashers[upload_id] = hasher
+        return hasher
+    
+    def init(self, upload_folder, user_id, filename, size=None):
+        now = time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.sweep(upload_folder, now)
+        
+        upload_id = uuid.uuid4().hex
+        part_path, meta_path = self._paths(upload_folder, upload_id)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w') as f:
+            json.dump({'user_id': user_id, 'filename': secure_filename(filename), 'size': size,
+                       'created_at': now}, f)
+        self._hashers[upload_id] = hashlib.sha256()
+        return upload_id
+    
+    def sweep(self, upload_folder, now=None):
+        """Delete uploads idle for longer than expiry; return how many were removed
+        
+        The last chunk written (the .part mtime) counts as activity, so slow
+        but live uploads survive. Stray .tmp files from interrupted direct
+        uploads are removed the same way.
+        """
+        now = now or time.time()
+        partial_dir = _partial_dir(upload_folder)
+        removed = 0
+        for entry in os.scandir(partial_dir):
+            name, extension = os.path.splitext(entry.name)
+            if extension not in ('.json', '.tmp'):
+                continue
+            part_path = os.path.join(partial_dir, f"{name}.part")
+            try:
+                last_activity = entry.stat().st_mtime
+                if extension == '.json' and os.path.exists(part_path):
+                    last_activity = max(last_activity, os.path.getmtime(part_path))
+                if now - last_activity < self.expiry:
+                    continue
+                
+                with self._upload_lock(name):
+                    if extension == '.json' and os.path.exists(part_path):
+                        os.remove(part_path)
+                    os.remove(entry.path)
+                    self._hashers.pop(name, None)
+            except FileNotFoundError:
+                continue  # completed or swept concurrently
+            with self._lock:
+                self._locks.pop(name, None)
+            removed += 1
+        
+        # Hashers whose sidecar is gone (e.g. removed by another worker's sweep)
+        for upload_id in list(self._hashers):
+            if not os.path.exists(os.path.join(partial_dir, f"{upload_id}.json")):
+                self._hashers.pop(upload_id, None)
+                with self._lock:
+                    self._locks.pop(upload_id, None)
+        if removed:
+            log.info('uploads_expired', removed=removed)
+        return removed
+    
+    def status(self, upload_folder, upload_id, user_id):
+        meta, _, _ = self._load(upload_folder, upload_id, user_id)
+        return {'upload_id': upload_id, 'offset': meta['offset'], 'size': meta['size']}
+    
+    def append(self, upload_folder, upload_id, user_id, offset, stream, max_size):
+        """Append one chunk at offset; returns the new offset"""
+        with self._upload_lock(upload_id):
+            meta, part_path, _ = self._load(upload_folder, upload_id, user_id)
+            if offset != meta['offset']:
+                raise UploadError(f"Offset mismatch, expected {meta['offset']}", 409)
+            
+            limit = max_size - offset
+            if meta['size'] is not None:
+                limit = min(limit, meta['size'] - offset)
+            hasher = self._hasher(upload_id, part_path)
+            partial = hasher.copy()
+            with open(part_path, 'ab') as out:
+                try:
+                    written = _copy_stream(stream, out, partial, limit)
+                except Exception:
+                    # Drop the partial chunk so the client can retry from offset
+                    out.truncate(offset)
+                    raise
+            self._hashers[upload_id] = partial
+            upload_bytes.inc(written, kind='chunked')
+            return offset + written
+    
+    def complete(self, upload_folder, upload_id, user_id):
+        """Finish an upload and return (filename, size, sha256, deduplicated)"""
+        with self._upload_lock(upload_id):
+            meta, part_path, meta_path = self._load(upload_folder, upload_id, user_id)
+            if meta['size'] is not None and meta['offset'] != meta['size']:
+                raise UploadError(f"Upload incomplete: {meta['offset']} of {meta['size']} bytes", 409)
+            
+            sha256 = self._hasher(upload_id, part_path).hexdigest()
+            filename, deduplicated = _finalize(part_path, sha256, meta['offset'],
+                                               file_extension(meta['filename']), upload_folder)
+            os.remove(meta_path)
+            self._hashers.pop(upload_id, None)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+        return filename, meta['offset'], sha256, deduplicated
+
+chunked_uploads = ChunkedUploads()
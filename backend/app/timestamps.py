@@ -0,0 +1,16 @@
+from datetime import timezone
+
+# 'iso' (ISO 8601 strings) or 'epoch_ms' (integer milliseconds since the epoch)
+_format = 'iso'
+
+def configure_timestamps(fmt):
+    global _format
+    _format = fmt
+
+def format_timestamp(value):
+    """Render a naive UTC datetime from the database in the configured format"""
+    if value is None:
+        return None
+    if _format == 'epoch_ms':
+        return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return value.isoformat()
@@ -0,0 +1,135 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from app.models import User
+from app.timestamps import format_timestamp
+
+def _grams(value, size):
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+def _all_grams(value):
+    return _grams(value, 2) | _grams(value, 3)
+
+class UserDirectory:
+    """In-memory username index for the user search box
+    
+    Prefix lookups use a sorted list of lowercase usernames; substring
+    lookups intersect bigram/trigram posting sets.
+    New users are added on register; users created by other workers are
+    picked up by an incremental refresh (id > last seen id) at most every
+    refresh_interval seconds. Answers for hot queries are cached briefly.
+    """
+    
+    def __init__(self):
+        self.refresh_interval = 30
+        self.cache_ttl = 10
+        self.cache_size = 1024
+        self._users = {}     # {user_id: serialized user dict}
+        self._names = []     # sorted [(username_lower, user_id)]
+        self._grams = {}     # {bigram or trigram: set(user_ids)}
+        self._max_id = 0
+        self._loaded = False
+        self._next_refresh = 0
+        self._cache = OrderedDict()  # {(query, limit): (expires_at, results)}
+        self._lock = threading.RLock()
+    
+    def configure(self, refresh_interval, cache_ttl, cache_size):
+        with self._lock:
+            self.refresh_interval = refresh_interval
+            self.cache_ttl = cache_ttl
+            self.cache_size = cache_size
+            self._cache.clear()
+    
+    def add(self, user):
+        """Index a user row (or its to_dict form)"""
+        data = user if isinstance(user, dict) else user.to_dict()
+        with self._lock:
+            self._index(data)
+            self._cache.clear()
+    
+    def _index(self, data):
+        user_id = data['id']
+        if user_id in self._users:
+            return
+        name = data['username'].lower()
+        self._users[user_id] = data
+        bisect.insort(self._names, (name, user_id))
+        for gram in _all_grams(name):
+            self._grams.setdefault(gram, set()).add(user_id)
+        self._max_id = max(self._max_id, user_id)
+    
+    def refresh(self):
+        """Load users created since the last refresh (all users the first time)"""
+        now = time.monotonic()
+        if self._loaded and now < self._next_refresh:
+            return
+        with self._lock:
+            if self._loaded and now < self._next_refresh:
+                return
+            rows = User.query.with_entities(User.id, User.username, User.email, User.created_at) \
+                .filter(User.id > self._max_id).order_by(User.id).all()
+            for row in rows:
+                self._index({
+                    'id': row.id,
+                    'username': row.username,
+                    'email': row.email,
+                    'created_at': format_timestamp(row.created_at)
+                })
+            if rows:
+                self._cache.clear()
+            self._loaded = True
+            self._next_refresh = now + self.refresh_interval
+    
+    def search(self, query, limit=20):
+        """Return up to limit user dicts: exact, then prefix, then substring matches"""
+        self.refresh()
+        query = (query or '').strip().lower()
+        key = (query, limit)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > now:
+                self._cache.move_to_end(key)
+                return entry[1]
+            
+            results = self._lookup(query, limit)
+            self._cache[key] = (now + self.cache_ttl, results)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return results
+    
+    def _lookup(self, query, limit):
+        if not query:
+            return [self._users[user_id] for user_id in heapq.nsmallest(limit, self._users)]
+        
+        # Prefix matches come out of the sorted list in lexicographic order,
+        # so an exact match (the shortest name with that prefix) is first
+        ids = []
+        position = bisect.bisect_left(self._names, (query,))
+        while position < len(self._names) and len(ids) < limit:
+            name, user_id = self._names[position]
+            if not name.startswith(query):
+                break
+            ids.append(user_id)
+            position += 1
+        
+        # Substring matches; a single character is too unselective to bother
+        if len(ids) < limit and len(query) >= 2:
+            grams = _grams(query, min(len(query), 3))
+            postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings and postings[0] else set()
+            prefixed = set(ids)
+            matches = []
+            for user_id in candidates - prefixed:
+                name = self._users[user_id]['username'].lower()
+                position = name.find(query)
+                if position > 0:
+                    matches.append((position, len(name), name, user_id))
+            matches.sort()
+            ids.extend(match[3] for match in matches[:limit - len(ids)])
+        
+        return [self._users[user_id] for user_id in ids]
+
+user_directory = UserDirectory()
@@ -1,17 +1,71 @@
 import bcrypt
-import os
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from flask import current_app
+from flask import current_app, session
 from functools import wraps
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_socketio import emit, disconnect
+from app.storage import store_stream
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password pool queue is full"""
+
+# Bounded pool for bcrypt work, set up by init_password_pool
+_password_pool = None
+_password_slots = None
+
+def init_password_pool(workers, queue_size):
+    """Start the bcrypt worker pool with room for queue_size waiting jobs
+    
+    Called first thing in create_app, before presence, Socket.IO or any
+    writer thread starts: a fork-based pool forks all of its workers on the
+    first submit, so warming it up there keeps the workers free of the app's
+    threads and sockets. Without fork (Windows) a
+    thread pool is used instead, as bcrypt releases the GIL while hashing.
+    """
+    global _password_pool, _password_slots
+    if _password_pool is not None or workers <= 0:
+        return
+    
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _password_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        _password_pool.submit(int).result()
+    else:
+        _password_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+    _password_slots = threading.BoundedSemaphore(workers + queue_size)
+
+def _run_password_job(func, *args):
+    if _password_pool is None:
+        return func(*args)
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Too many authentication requests, try again shortly')
+    try:
+        return _password_pool.submit(func, *args).result()
+    finally:
+        _password_slots.release()
+
+def _bcrypt_hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _bcrypt_check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
 
 def hash_password(password):
     """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return _run_password_job(_bcrypt_hash, password.encode('utf-8'), current_app.config['BCRYPT_ROUNDS'])
 
 def check_password(password, hashed):
     """Check if password matches hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    return _run_password_job(_bcrypt_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+def password_needs_rehash(hashed):
+    """Check if a hash was made with a different cost than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed.split('$')[2]) != current_app.config['BCRYPT_ROUNDS']
+    except (IndexError, ValueError):
+        return True
 
 def allowed_file(filename, allowed_extensions=None):
     """Check if file extension is allowed"""
@@ -20,6 +74,30 @@ def allowed_file(filename, allowed_extensions=None):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+MESSAGE_TYPES = ('text', 'audio', 'file')
+
+def validate_message(content, message_type, file_path):
+    """Return an error string if a message's fields cannot be stored, else None
+    
+    Checked before a message is persisted or broadcast: with write-behind a
+    row that the database rejects would otherwise be acknowledged and lost.
+    """
+    if message_type not in MESSAGE_TYPES:
+        return f"Unknown message type: {message_type!r}"
+    if content is not None and not isinstance(content, str):
+        return 'Message content must be a string'
+    if file_path is not None and not isinstance(file_path, str):
+        return 'File path must be a string'
+    if message_type == 'text' and not content:
+        return 'Message content is required'
+    if message_type in ('audio', 'file') and not file_path:
+        return 'File path is required for file/audio messages'
+    if content is not None and len(content) > current_app.config['MESSAGE_MAX_LENGTH']:
+        return f"Message content is longer than {current_app.config['MESSAGE_MAX_LENGTH']} characters"
+    if file_path is not None and len(file_path) > 255:
+        return 'File path is too long'
+    return None
+
 def save_uploaded_file(file, upload_folder=None, allowed_extensions=None):
     """Save uploaded file and return the path"""
     if upload_folder is None:
@@ -28,24 +106,29 @@ def save_uploaded_file(file, upload_folder=None, allowed_extensions=None):
         allowed_extensions = current_app.config['ALLOWED_EXTENSIONS']
     
     if file and allowed_file(file.filename, allowed_extensions):
-        filename = secure_filename(file.filename)
-        # Add timestamp to avoid conflicts
-        import time
-        filename = f"{int(time.time())}_{filename}"
-        filepath = os.path.join(upload_folder, filename)
-        file.save(filepath)
+        # Stored once by content hash, so identical uploads share one file
+        filename, _ = store_stream(file.stream, secure_filename(file.filename), upload_folder)
         return filename
     return None
 
 def jwt_required_socket(f):
-    """Decorator to require JWT for socket events"""
+    """Decorator to require JWT for socket events
+    
+    The token is verified once by the connect handler and the identity is
+    cached in the Socket.IO session, so events only check its expiry.
+    """
     @wraps(f)
     def wrapped(*args, **kwargs):
-        try:
-            verify_jwt_in_request()
-            kwargs['user_id'] = get_jwt_identity()
-        except:
-            return {'error': 'Authentication required'}, 401
+        user_id = session.get('user_id')
+        if user_id is None:
+            emit('error', {'message': 'Authentication required'})
+            return
+        token_exp = session.get('token_exp')
+        if token_exp is not None and token_exp <= time.time():
+            session.pop('user_id', None)
+            emit('error', {'message': 'Token expired'})
+            disconnect()
+            return
+        kwargs['user_id'] = user_id
         return f(*args, **kwargs)
     return wrapped
-
@@ -1,13 +1,38 @@
 from flask_socketio import emit, join_room, leave_room
-from flask import request
+from flask import current_app, request, session
 from flask_jwt_extended import decode_token
 from app import db, socketio
 from app.models import Chat, Message, ChatParticipant, User
+from app.calls import call_registry, call_room, ice_batcher
+from app.http_cache import advance_last_message
+from app.logs import get_logger
+from app.membership import membership_cache
+from app.presence import presence, presence_notifier, contact_ids
+from app.message_writer import message_writer, message_payload, WriterBusy
+from app.rate_limit import rate_limiter, rate_limit_error, socket_rate_limit
+from app.read_state import count_unread, read_receipts
+from app.replay import replay_buffer, sync_chats
+from app.serializers import serialize_message
+from app.storage import add_file_references
+from app.utils import jwt_required_socket, validate_message
 from datetime import datetime
 import json
 
-# Store connected users: {user_id: socket_id}
-connected_users = {}
+log = get_logger('sockets')
+
+def _bind_identity(decoded):
+    """Cache a verified JWT identity in the Socket.IO session"""
+    session['user_id'] = decoded['sub']
+    session['token_exp'] = decoded.get('exp')
+    return decoded['sub']
+
+def _session_username(user_id):
+    """Return the connection's username, loading it once per session"""
+    username = session.get('username')
+    if username is None:
+        user = db.session.get(User, user_id)
+        username = session['username'] = user.username if user else None
+    return username
 
 def register_socket_handlers(socketio):
     
@@ -19,64 +44,79 @@ def register_socket_handlers(socketio):
             if not token:
                 return False
             
-            decoded = decode_token(token)
-            user_id = decoded['sub']
+            user_id = _bind_identity(decode_token(token))
             
-            # Store connection
-            connected_users[user_id] = request.sid
+            # Store connection; only the first device announces the user
+            first_device = presence.add(user_id, request.sid)
             
-            # Join user's personal room
+            # Join user's personal room and every chat room in one query
             join_room(f"user_{user_id}")
+            for (chat_id,) in db.session.query(ChatParticipant.chat_id).filter_by(user_id=user_id):
+                join_room(f"chat_{chat_id}")
             
-            # Notify others that user is online
-            socketio.emit('user_online', {'user_id': user_id}, room=None, include_self=False)
+            # Notify contacts that user is online
+            if first_device:
+                presence_notifier.notify(user_id, True)
             
-            print(f"User {user_id} connected: {request.sid}")
+            log.info('user_connected', user_id=user_id, sid=request.sid)
             return True
         except Exception as e:
-            print(f"Connection error: {e}")
+            log.warning('connect_rejected', error=str(e))
             return False
     
+    @socketio.on('reauthenticate')
+    def handle_reauthenticate(data):
+        """Refresh the session identity with a new token before the old one expires"""
+        try:
+            token = data.get('token') if data else None
+            if not token:
+                emit('error', {'message': 'Authentication required'})
+                return
+            
+            decoded = decode_token(token)
+            if decoded['sub'] != session.get('user_id'):
+                emit('error', {'message': 'Token does not match this connection'})
+                return
+            
+            _bind_identity(decoded)
+            emit('reauthenticated', {'user_id': decoded['sub']})
+        except Exception as e:
+            emit('error', {'message': str(e)})
+    
     @socketio.on('disconnect')
     def handle_disconnect():
         """Handle client disconnection"""
         try:
             # Find user by socket_id
-            user_id = None
-            for uid, sid in connected_users.items():
-                if sid == request.sid:
-                    user_id = uid
-                    break
+            user_id, last_device = presence.remove_sid(request.sid)
             
             if user_id:
-                del connected_users[user_id]
-                socketio.emit('user_offline', {'user_id': user_id}, room=None, include_self=False)
-                print(f"User {user_id} disconnected")
+                if last_device:
+                    presence_notifier.notify(user_id, False)
+                    # Calls left with a single participant are over
+                    for chat_id in call_registry.leave_everywhere(user_id):
+                        socketio.emit('call_end', {'chat_id': chat_id, 'ended_by': user_id}, room=call_room(chat_id))
+                        call_registry.end(chat_id)
+                log.info('user_disconnected', user_id=user_id, sid=request.sid)
         except Exception as e:
-            print(f"Disconnect error: {e}")
+            log.exception('disconnect_failed')
     
     @socketio.on('join_chat')
-    def handle_join_chat(data):
+    @jwt_required_socket
+    @socket_rate_limit('join_chat')
+    def handle_join_chat(data, user_id=None):
         """Join a chat room"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
-                return
-            
-            decoded = decode_token(token)
-            user_id = decoded['sub']
             chat_id = data.get('chat_id')
             
             # Verify user is participant
-            participant = ChatParticipant.query.filter_by(chat_id=chat_id, user_id=user_id).first()
-            if not participant:
+            if not membership_cache.is_participant(chat_id, user_id):
                 emit('error', {'message': 'Access denied'})
                 return
             
             join_room(f"chat_{chat_id}")
             emit('joined_chat', {'chat_id': chat_id})
-            print(f"User {user_id} joined chat {chat_id}")
+            log.debug('chat_joined', user_id=user_id, chat_id=chat_id)
         except Exception as e:
             emit('error', {'message': str(e)})
     
@@ -91,97 +131,139 @@ def register_socket_handlers(socketio):
             emit('error', {'message': str(e)})
     
     @socketio.on('send_message')
-    def handle_send_message(data):
+    @jwt_required_socket
+    @socket_rate_limit('send_message', echo=True)
+    def handle_send_message(data, user_id=None):
         """Handle new message"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
-                return
-            
-            decoded = decode_token(token)
-            user_id = decoded['sub']
             chat_id = data.get('chat_id')
             content = data.get('content')
             message_type = data.get('message_type', 'text')
             file_path = data.get('file_path')
             
             # Verify user is participant
-            participant = ChatParticipant.query.filter_by(chat_id=chat_id, user_id=user_id).first()
-            if not participant:
+            if not membership_cache.is_participant(chat_id, user_id):
                 emit('error', {'message': 'Access denied'})
                 return
             
-            # Create message
-            message = Message(
-                chat_id=chat_id,
-                user_id=user_id,
-                content=content,
-                message_type=message_type,
-                file_path=file_path
-            )
-            db.session.add(message)
-            db.session.commit()
+            error = validate_message(content, message_type, file_path)
+            if error:
+                emit('error', {'message': error})
+                return
+            
+            if message_writer.enabled:
+                # Broadcast right away; the writer persists it in the next batch
+                row = message_writer.submit(int(chat_id), user_id, content, message_type, file_path)
+                message_data = message_payload(row, _session_username(user_id))
+            else:
+                # Create message
+                message = Message(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    content=content,
+                    message_type=message_type,
+                    file_path=file_path
+                )
+                db.session.add(message)
+                add_file_references([file_path])
+                db.session.flush()
+                advance_last_message({int(chat_id): message.id})
+                count_unread([(int(chat_id), user_id)])
+                # Serialize before commit expires the instance and forces a reload
+                message_data = serialize_message(message, _session_username(user_id))
+                db.session.commit()
             
             # Emit to all participants in the chat room
-            message_data = message.to_dict()
             socketio.emit('new_message', message_data, room=f"chat_{chat_id}")
+            replay_buffer.record(message_data)
             
-            print(f"Message sent in chat {chat_id} by user {user_id}")
+            log.debug('message_sent', chat_id=chat_id, user_id=user_id)
+        except WriterBusy as e:
+            # Same shape as a rate limit rejection, so the client resends it
+            emit('error', {'message': str(e), 'code': 'busy', 'event': 'send_message', 'retry': True,
+                           'retry_after': 1, 'data': data})
         except Exception as e:
             db.session.rollback()
             emit('error', {'message': str(e)})
     
-    @socketio.on('call_offer')
-    def handle_call_offer(data):
-        """Handle WebRTC call offer"""
+    @socketio.on('mark_read')
+    @jwt_required_socket
+    @socket_rate_limit('mark_read')
+    def handle_mark_read(data, user_id=None):
+        """Advance the read marker; writes are coalesced and flushed in batches"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
+            chat_id = int(data.get('chat_id'))
+            message_id = int(data.get('message_id'))
+            if not membership_cache.is_participant(chat_id, user_id):
+                emit('error', {'message': 'Access denied'})
                 return
-            
-            decoded = decode_token(token)
-            caller_id = decoded['sub']
-            chat_id = data.get('chat_id')
+            read_receipts.mark(user_id, chat_id, message_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id and message_id are required'})
+        except Exception as e:
+            emit('error', {'message': str(e)})
+    
+    @socketio.on('sync')
+    @jwt_required_socket
+    @socket_rate_limit('sync')
+    def handle_sync(data, user_id=None):
+        """Send what a reconnecting client missed, given its last seen id per chat"""
+        try:
+            last_seen = data.get('chats') if data else None
+            if not isinstance(last_seen, dict):
+                emit('error', {'message': 'chats must map chat ids to message ids'})
+                return
+            emit('sync_result', {
+                'chats': sync_chats(user_id, last_seen, current_app.config['SYNC_MAX_MESSAGES'])
+            })
+        except Exception as e:
+            emit('error', {'message': str(e)})
+    
+    @socketio.on('call_offer')
+    @jwt_required_socket
+    @socket_rate_limit('call_offer')
+    def handle_call_offer(data, user_id=None):
+        """Start a call: one emit of the offer to the call_{chat_id} room"""
+        try:
+            caller_id = user_id
+            chat_id = int(data.get('chat_id'))
             offer = data.get('offer')
             
             # Verify caller is participant
-            participant = ChatParticipant.query.filter_by(chat_id=chat_id, user_id=caller_id).first()
-            if not participant:
+            if not membership_cache.is_participant(chat_id, caller_id):
                 emit('error', {'message': 'Access denied'})
                 return
             
-            # Get other participants
-            participants = ChatParticipant.query.filter_by(chat_id=chat_id).filter(ChatParticipant.user_id != caller_id).all()
-            
-            # Send offer to other participants
-            for p in participants:
-                socketio.emit('call_offer', {
-                    'chat_id': chat_id,
-                    'caller_id': caller_id,
-                    'offer': offer
-                }, room=f"user_{p.user_id}")
+            call_registry.start(chat_id, caller_id)
+            socketio.emit('call_offer', {
+                'chat_id': chat_id,
+                'caller_id': caller_id,
+                'offer': offer
+            }, room=call_room(chat_id), skip_sid=request.sid)
             
-            print(f"Call offer from user {caller_id} in chat {chat_id}")
+            log.info('call_offer', chat_id=chat_id, caller_id=caller_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id is required'})
         except Exception as e:
             emit('error', {'message': str(e)})
     
     @socketio.on('call_answer')
-    def handle_call_answer(data):
+    @jwt_required_socket
+    @socket_rate_limit('call_answer')
+    def handle_call_answer(data, user_id=None):
         """Handle WebRTC call answer"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
-                return
-            
-            decoded = decode_token(token)
-            answerer_id = decoded['sub']
-            chat_id = data.get('chat_id')
+            answerer_id = user_id
+            chat_id = int(data.get('chat_id'))
             caller_id = data.get('caller_id')
             answer = data.get('answer')
             
+            # Membership comes from the call session, not the database
+            session = call_registry.join(chat_id, answerer_id)
+            if session is None or caller_id not in session.participants:
+                emit('error', {'message': 'Access denied'})
+                return
+            
             # Send answer to caller
             socketio.emit('call_answer', {
                 'chat_id': chat_id,
@@ -189,76 +271,83 @@ def register_socket_handlers(socketio):
                 'answer': answer
             }, room=f"user_{caller_id}")
             
-            print(f"Call answer from user {answerer_id} to caller {caller_id}")
+            log.info('call_answer', chat_id=chat_id, answerer_id=answerer_id, caller_id=caller_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id is required'})
         except Exception as e:
             emit('error', {'message': str(e)})
     
-    @socketio.on('ice_candidate')
-    def handle_ice_candidate(data):
-        """Handle WebRTC ICE candidate"""
+    def _queue_ice_candidates(event, data, sender_id, candidates):
+        # One bucket for both events, charged per candidate
+        retry_after = rate_limiter.check(sender_id, 'ice_candidate', len(candidates))
+        if retry_after:
+            emit('error', rate_limit_error(event, retry_after))
+            return
+        chat_id = int(data.get('chat_id'))
+        target_id = data.get('target_id')
+        participants = call_registry.participants(chat_id)
+        if sender_id not in participants or (target_id is not None and target_id not in participants):
+            emit('error', {'message': 'Access denied'})
+            return
+        ice_batcher.add(chat_id, sender_id, target_id, candidates, skip_sid=request.sid)
+    
+    @socketio.on('ice_candidates')
+    @jwt_required_socket
+    def handle_ice_candidates(data, user_id=None):
+        """Handle a batch of WebRTC ICE candidates for one peer"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
+            candidates = data.get('candidates')
+            if not isinstance(candidates, list):
+                emit('error', {'message': 'candidates must be a list'})
                 return
-            
-            decoded = decode_token(token)
-            sender_id = decoded['sub']
-            chat_id = data.get('chat_id')
-            target_id = data.get('target_id')
-            candidate = data.get('candidate')
-            
-            # Send ICE candidate to target
-            socketio.emit('ice_candidate', {
-                'chat_id': chat_id,
-                'sender_id': sender_id,
-                'candidate': candidate
-            }, room=f"user_{target_id}")
+            _queue_ice_candidates('ice_candidates', data, user_id, candidates)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id is required'})
+        except Exception as e:
+            emit('error', {'message': str(e)})
+    
+    @socketio.on('ice_candidate')
+    @jwt_required_socket
+    def handle_ice_candidate(data, user_id=None):
+        """Handle a single WebRTC ICE candidate (older clients); delivered batched"""
+        try:
+            _queue_ice_candidates('ice_candidate', data, user_id, [data.get('candidate')])
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id is required'})
         except Exception as e:
             emit('error', {'message': str(e)})
     
     @socketio.on('call_end')
-    def handle_call_end(data):
+    @jwt_required_socket
+    @socket_rate_limit('call_end')
+    def handle_call_end(data, user_id=None):
         """Handle call end"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
+            chat_id = int(data.get('chat_id'))
+            if user_id not in call_registry.participants(chat_id):
+                emit('error', {'message': 'Access denied'})
                 return
             
-            decoded = decode_token(token)
-            user_id = decoded['sub']
-            chat_id = data.get('chat_id')
-            
-            # Get all participants
-            participants = ChatParticipant.query.filter_by(chat_id=chat_id).all()
-            
-            # Notify all participants
-            for p in participants:
-                if p.user_id != user_id:
-                    socketio.emit('call_end', {
-                        'chat_id': chat_id,
-                        'ended_by': user_id
-                    }, room=f"user_{p.user_id}")
+            # Notify everyone in the call with a single room emit, then tear it down
+            socketio.emit('call_end', {
+                'chat_id': chat_id,
+                'ended_by': user_id
+            }, room=call_room(chat_id), skip_sid=request.sid)
+            call_registry.end(chat_id)
             
-            print(f"Call ended by user {user_id} in chat {chat_id}")
+            log.info('call_ended', chat_id=chat_id, user_id=user_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id is required'})
         except Exception as e:
             emit('error', {'message': str(e)})
     
     @socketio.on('get_online_users')
-    def handle_get_online_users(data):
-        """Get list of online users"""
+    @jwt_required_socket
+    def handle_get_online_users(data=None, user_id=None):
+        """Get list of online contacts"""
         try:
-            token = data.get('token')
-            if not token:
-                emit('error', {'message': 'Authentication required'})
-                return
-            
-            decoded = decode_token(token)
-            user_id = decoded['sub']
-            
-            # Get all online user IDs
-            online_user_ids = list(connected_users.keys())
+            # Only users who share a chat with the caller
+            online_user_ids = presence.filter_online(contact_ids(user_id))
             
             emit('online_users', {'user_ids': online_user_ids})
         except Exception as e:
@@ -0,0 +1,43 @@
+"""Move old chat history into compressed archive segments on demand
+
+Runs the same job as the background archiver (ARCHIVE_ENABLED) once, in
+bounded batches, and prints what was moved. Archived messages are still
+returned by GET /api/chats/<id>/messages when paging back.
+
+    python archive.py --older-than-days 180
+    python archive.py --chat 42 --max-batches 10
+"""
+import argparse
+import os
+from datetime import timedelta
+
+# This process runs the job itself; keep create_app from also starting the
+# periodic archiver (Config reads this at import time)
+os.environ['ARCHIVE_ENABLED'] = 'false'
+
+from app import create_app
+from app.archive import message_archiver
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old chat messages')
+    parser.add_argument('--older-than-days', type=int, help='default: ARCHIVE_AFTER_DAYS')
+    parser.add_argument('--batch-size', type=int, help='messages per transaction (default: ARCHIVE_BATCH_SIZE)')
+    parser.add_argument('--segment-size', type=int, help='messages per segment (default: ARCHIVE_SEGMENT_SIZE)')
+    parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+    parser.add_argument('--chat', type=int, action='append', dest='chat_ids', help='only this chat (repeatable)')
+    args = parser.parse_args()
+    
+    app = create_app()
+    if args.batch_size:
+        message_archiver.batch_size = args.batch_size
+    if args.segment_size:
+        message_archiver.segment_size = args.segment_size
+    max_age = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    
+    with app.app_context():
+        totals = message_archiver.run(max_batches=args.max_batches, chat_ids=args.chat_ids, max_age=max_age)
+    print(f"Archived {totals['messages']} messages from {totals['chats']} chats into "
+          f"{totals['segments']} segments ({totals['bytes']} bytes compressed, {totals['batches']} batches)")
+
+if __name__ == '__main__':
+    main()
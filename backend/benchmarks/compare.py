@@ -0,0 +1,77 @@
+"""Compare two benchmark reports and flag regressions
+
+    python -m benchmarks.compare base.json head.json --threshold 0.15
+
+Exits with status 1 when any operation's p95 latency grows, or its
+throughput drops, by more than the threshold, or when a phase issues
+more database statements per operation than before.
+"""
+import argparse
+import json
+import sys
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+def _label(phase_name, operation):
+    return operation if operation == phase_name else f'{phase_name} / {operation}'
+
+def compare(base, head, threshold):
+    """Return (rows, regressions) for every operation present in both reports"""
+    rows, regressions = [], []
+    for phase_name, phase in head['phases'].items():
+        base_phase = base['phases'].get(phase_name)
+        if base_phase is None:
+            continue
+        
+        old_queries, new_queries = base_phase.get('queries_per_op'), phase.get('queries_per_op')
+        # Background flushes add a little noise; a new query per operation does not hide in 5%
+        if old_queries is not None and new_queries is not None and new_queries > old_queries * 1.05 + 0.01:
+            regressions.append(f'{phase_name}: queries/op {old_queries} -> {new_queries}')
+        
+        for operation, stats in phase['operations'].items():
+            old = base_phase['operations'].get(operation)
+            if not old or not old['latency_ms'] or not stats['latency_ms']:
+                continue
+            p95 = _change(old['latency_ms']['p95'], stats['latency_ms']['p95'])
+            throughput = _change(old['throughput_per_s'], stats['throughput_per_s'])
+            rows.append((phase_name, operation, old['latency_ms']['p95'], stats['latency_ms']['p95'], p95,
+                         old['throughput_per_s'], stats['throughput_per_s'], throughput))
+            if p95 is not None and p95 > threshold:
+                regressions.append(f'{_label(phase_name, operation)}: p95 {p95:+.0%}')
+            if throughput is not None and throughput < -threshold:
+                regressions.append(f'{_label(phase_name, operation)}: throughput {throughput:+.0%}')
+            if stats['errors'] > old['errors']:
+                regressions.append(f'{_label(phase_name, operation)}: errors {old["errors"]} -> {stats["errors"]}')
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative change (0.15 = 15%%)')
+    args = parser.parse_args(argv)
+    
+    base, head = _load(args.base), _load(args.head)
+    rows, regressions = compare(base, head, args.threshold)
+    
+    print(f"base {base['meta'].get('commit')}  head {head['meta'].get('commit')}")
+    print(f"{'operation':<48} {'p95 ms':>21} {'change':>7} {'ops/s':>19} {'change':>7}")
+    for phase_name, operation, old_p95, new_p95, p95, old_tp, new_tp, tp in rows:
+        print(f"{_label(phase_name, operation):<48} {old_p95:>9.1f} -> {new_p95:>8.1f} {p95:>+7.0%} "
+              f"{old_tp or 0:>8.1f} -> {new_tp or 0:>7.1f} {tp if tp is not None else 0:>+7.0%}")
+    
+    if regressions:
+        print('\nRegressions:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Load and latency benchmark for the REST and Socket.IO paths
+
+Boots create_app against a scratch database, seeds it, serves it on a
+local port and drives it with real HTTP and python-socketio clients.
+Results (throughput, p50/p95/p99 latency, DB statements per operation)
+are written as JSON so runs on different commits can be compared with
+benchmarks/compare.py.
+
+    cd backend
+    python -m benchmarks.run --users 500 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='empty database to use (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--group-size', type=int, default=10)
+    parser.add_argument('--messages-per-chat', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel clients per phase')
+    parser.add_argument('--requests', type=int, default=25, help='requests per client for each REST endpoint')
+    parser.add_argument('--socket-clients', type=int, default=50)
+    parser.add_argument('--messages-per-client', type=int, default=10)
+    parser.add_argument('--serializer', choices=('json', 'msgpack'), default='json',
+                        help='Socket.IO packet encoding for server and clients')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the generated data')
+    parser.add_argument('--skip-rest', action='store_true')
+    parser.add_argument('--skip-socket', action='store_true')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _serve(app, socketio, port):
+    """Run the app on a daemon thread and wait until it answers"""
+    thread = threading.Thread(target=socketio.run, args=(app,), daemon=True,
+                              kwargs={'host': '127.0.0.1', 'port': port, 'log_output': False,
+                                      'allow_unsafe_werkzeug': True, 'use_reloader': False})
+    thread.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f'Server did not start on port {port}')
+
+def run(args):
+    # Config reads the environment at import time, so set it up first
+    scratch = tempfile.mkdtemp(prefix='chat-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(scratch, 'bench.sqlite')
+    os.environ['UPLOAD_FOLDER'] = os.path.join(scratch, 'uploads')
+    os.environ['SOCKETIO_SERIALIZER'] = args.serializer
+    # Measure capacity, not the per-user limits (set it to 'true' to include them)
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    
+    from flask_jwt_extended import create_access_token
+    from app import create_app, db, socketio
+    from app.models import User
+    from app.user_directory import user_directory
+    from benchmarks.seed import seed
+    from benchmarks.stats import QueryCounter, Recorder
+    from benchmarks.scenarios import run_rest, run_sockets
+    
+    app = create_app()
+    with app.app_context():
+        if db.session.query(User.id).first() is not None:
+            raise SystemExit('The benchmark database must be empty')
+        layout = seed(args.users, args.groups, args.group_size, args.messages_per_chat, rng_seed=args.seed)
+        user_directory.refresh()
+        tokens = {user_id: create_access_token(identity=user_id) for user_id, _ in layout['users']}
+        counter = QueryCounter()
+        counter.attach(db.engine)
+        dialect = db.engine.dialect.name
+    
+    port = _free_port()
+    _serve(app, socketio, port)
+    base_url = f'http://127.0.0.1:{port}'
+    recorder = Recorder(counter)
+    
+    if not args.skip_rest:
+        run_rest(base_url, recorder, layout['users'], tokens, layout['chats_by_user'],
+                 args.concurrency, args.requests)
+    if not args.skip_socket:
+        run_sockets(base_url, recorder, layout, tokens, args.socket_clients, args.concurrency,
+                    args.messages_per_client, serializer=args.serializer)
+    
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': _git('rev-parse', 'HEAD'),
+            'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': dialect,
+            'message_persistence': app.config['MESSAGE_PERSISTENCE'],
+            'json_backend': app.config['JSON_BACKEND'],
+            'socketio_serializer': app.config['SOCKETIO_SERIALIZER'],
+            'timestamp_format': app.config['TIMESTAMP_FORMAT'],
+            'rate_limits': app.config['RATE_LIMIT_ENABLED'],
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'database_url')}
+        },
+        'seed': layout['stats'],
+        'phases': recorder.summary()
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    # App logs already go to stderr, but the in-process Werkzeug server prints
+    # its startup banner to stdout; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    
+    encoded = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import socketio
+
+TIMEOUT = 10  # seconds to wait for any single reply
+
+def _run_workers(concurrency, work):
+    """Run work(worker_index) on concurrency threads and wait for all of them"""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(work, i) for i in range(concurrency)]:
+            future.result()
+
+def run_rest(base_url, recorder, users, tokens, chats_by_user, concurrency, requests_per_worker):
+    """Hit each REST endpoint in its own phase with concurrency parallel clients"""
+    
+    def chat_list(http, user_id, n):
+        return http.get(f'{base_url}/api/chats')
+    
+    def message_page(http, user_id, n):
+        chats = chats_by_user[user_id]
+        return http.get(f'{base_url}/api/chats/{chats[n % len(chats)]}/messages')
+    
+    def user_search(http, user_id, n):
+        return http.get(f'{base_url}/api/users', params={'search': f'user{n % 10}'})
+    
+    def upload(http, user_id, n):
+        # Random bytes so content-addressed storage cannot dedupe the writes
+        files = {'file': (f'bench-{n}.txt', os.urandom(16384), 'text/plain')}
+        return http.post(f'{base_url}/api/upload', files=files)
+    
+    endpoints = [
+        ('GET /api/chats', chat_list),
+        ('GET /api/chats/<id>/messages', message_page),
+        ('GET /api/users', user_search),
+        ('POST /api/upload', upload)
+    ]
+    
+    for name, call in endpoints:
+        def work(worker):
+            user_id, _ = users[worker % len(users)]
+            http = requests.Session()
+            http.headers['Authorization'] = f'Bearer {tokens[user_id]}'
+            for n in range(requests_per_worker):
+                started = time.perf_counter()
+                try:
+                    ok = call(http, user_id, worker + n).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                recorder.record(name, time.perf_counter() - started, ok)
+            http.close()
+        
+        with recorder.phase(name):
+            _run_workers(concurrency, work)
+
+class BenchClient:
+    """A python-socketio client that can wait for specific server events
+    
+    Messages sent by the benchmark carry their send time, so every member
+    that receives one records how long delivery took (under the
+    'socket send_message' phase, even if it arrives after the phase ends).
+    """
+    
+    EVENTS = ('joined_chat', 'call_offer', 'call_answer', 'ice_candidates', 'call_end', 'error')
+    
+    def __init__(self, user_id, token, recorder, serializer='json'):
+        self.user_id = user_id
+        self.token = token
+        self.recorder = recorder
+        options = {'serializer': 'msgpack'} if serializer == 'msgpack' else {}
+        self.sio = socketio.Client(reconnection=False, **options)
+        self._inbox = {}  # {event: [payload, ...]}
+        self._cond = threading.Condition()
+        for name in self.EVENTS:
+            self.sio.on(name, self._handler(name))
+        self.sio.on('new_message', self._on_message)
+    
+    def _handler(self, name):
+        def receive(data=None):
+            self._push(name, data)
+        return receive
+    
+    def _push(self, name, data):
+        with self._cond:
+            self._inbox.setdefault(name, []).append(data)
+            self._cond.notify_all()
+    
+    def _on_message(self, data):
+        content = data.get('content') or ''
+        if not content.startswith('bench '):
+            return
+        if data.get('user_id') == self.user_id:
+            self._push('new_message', data)
+        else:
+            self.recorder.record('message_delivery', time.perf_counter() - float(content.split()[1]),
+                                 phase='socket send_message')
+    
+    def connect(self, base_url):
+        self.sio.connect(base_url, auth={'token': self.token}, transports=['websocket'], wait_timeout=TIMEOUT)
+    
+    def emit(self, name, data):
+        self.sio.emit(name, data)
+    
+    def wait_for(self, name, match=lambda data: True, timeout=TIMEOUT):
+        """Return (and consume) the first payload of event name that matches"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for i, data in enumerate(self._inbox.get(name, [])):
+                    if match(data):
+                        return self._inbox[name].pop(i)
+                if self._inbox.get('error'):
+                    raise RuntimeError(self._inbox['error'].pop(0))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'No {name} within {timeout}s')
+                self._cond.wait(remaining)
+    
+    def disconnect(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+def _timed(recorder, name, action):
+    started = time.perf_counter()
+    try:
+        action()
+    except Exception:
+        recorder.record(name, time.perf_counter() - started, ok=False)
+        return False
+    recorder.record(name, time.perf_counter() - started)
+    return True
+
+def run_sockets(base_url, recorder, layout, tokens, client_count, concurrency, messages_per_client,
+                serializer='json'):
+    """Connect, join, send and run call signaling with client_count clients"""
+    users = layout['users'][:client_count]
+    clients = [BenchClient(user_id, tokens[user_id], recorder, serializer) for user_id, _ in users]
+    connected = set()
+    
+    def each_client(action):
+        def work(worker):
+            for client in clients[worker::concurrency]:
+                action(client)
+        _run_workers(min(concurrency, len(clients)), work)
+    
+    with recorder.phase('socket connect', primary='connect'):
+        def connect(client):
+            if _timed(recorder, 'connect', lambda: client.connect(base_url)):
+                connected.add(client.user_id)
+        each_client(connect)
+    
+    with recorder.phase('socket join_chat', primary='join_chat'):
+        def join(client):
+            for chat_id in layout['chats_by_user'][client.user_id]:
+                _timed(recorder, 'join_chat', lambda: (
+                    client.emit('join_chat', {'chat_id': chat_id}),
+                    client.wait_for('joined_chat', lambda data: data['chat_id'] == chat_id)))
+        each_client(lambda client: client.user_id in connected and join(client))
+    
+    with recorder.phase('socket send_message', primary='send_message'):
+        def send(client):
+            chats = layout['chats_by_user'][client.user_id]
+            for n in range(messages_per_client):
+                chat_id = chats[n % len(chats)]
+                content = f'bench {time.perf_counter():.9f} {client.user_id}-{n}'
+                _timed(recorder, 'send_message', lambda: (
+                    client.emit('send_message', {'chat_id': chat_id, 'content': content}),
+                    client.wait_for('new_message', lambda data: data['content'] == content)))
+        each_client(lambda client: client.user_id in connected and send(client))
+    time.sleep(0.5)  # let the last broadcasts reach every member
+    
+    # One call per direct chat whose two members are both connected
+    by_user = {client.user_id: client for client in clients}
+    calls = [(chat_id, by_user[a], by_user[b]) for chat_id, a, b in layout['direct']
+             if a in connected and b in connected]
+    with recorder.phase('socket call signaling', primary='call_offer'):
+        def call(worker):
+            for chat_id, caller, callee in calls[worker::concurrency]:
+                in_chat = lambda data: data['chat_id'] == chat_id
+                steps = [
+                    ('call_offer', lambda: (
+                        caller.emit('call_offer', {'chat_id': chat_id, 'offer': {'type': 'offer', 'sdp': 'v=0'}}),
+                        callee.wait_for('call_offer', in_chat))),
+                    ('call_answer', lambda: (
+                        callee.emit('call_answer', {'chat_id': chat_id, 'caller_id': caller.user_id,
+                                                    'answer': {'type': 'answer', 'sdp': 'v=0'}}),
+                        caller.wait_for('call_answer', in_chat))),
+                    ('ice_candidates', lambda: (
+                        caller.emit('ice_candidates', {'chat_id': chat_id, 'target_id': callee.user_id,
+                                                       'candidates': [{'candidate': f'c{i}'} for i in range(5)]}),
+                        callee.wait_for('ice_candidates', in_chat))),
+                    ('call_end', lambda: (
+                        caller.emit('call_end', {'chat_id': chat_id}),
+                        callee.wait_for('call_end', in_chat)))
+                ]
+                for name, action in steps:
+                    if not _timed(recorder, name, action):
+                        break
+        if calls:
+            _run_workers(min(concurrency, len(calls)), call)
+    
+    each_client(BenchClient.disconnect)
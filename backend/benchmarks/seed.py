@@ -0,0 +1,95 @@
+import random
+import time
+from datetime import datetime, timedelta
+import bcrypt
+from sqlalchemy import func, insert, select
+from app import db
+from app.models import User, Chat, ChatParticipant, Message
+
+WORDS = ('hola', 'mensaje', 'reunión', 'mañana', 'proyecto', 'archivo', 'llamada', 'grupo', 'listo',
+         'gracias', 'revisar', 'código', 'servidor', 'prueba', 'cliente', 'fecha', 'nota', 'video')
+BATCH_SIZE = 5000
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+def seed(users, groups, group_size, messages_per_chat, password='benchmark', rng_seed=1):
+    """Fill an empty database with users, chats and message history
+    
+    Every user gets a direct chat with the next user (wrapping around) and
+    groups get group_size random members. Rows go in with multi-row
+    INSERTs; the password is hashed once at a low cost and shared, since
+    login is not part of the benchmark. Returns the layout used by the
+    scenarios: {'users': [(id, username)], 'direct': [(chat_id, a, b)],
+    'groups': [(chat_id, [member ids])], 'chats_by_user': {id: [chat ids]}}.
+    """
+    rng = random.Random(rng_seed)
+    started = time.perf_counter()
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(4)).decode('utf-8')
+    now = datetime.utcnow()
+    
+    _insert(User, [{'username': f'user{i}', 'email': f'user{i}@bench.local', 'password_hash': password_hash,
+                    'created_at': now} for i in range(users)])
+    user_ids = [row.id for row in db.session.query(User.id).order_by(User.id)]
+    
+    # Chats: direct pairs first, then groups, with members known up front
+    layouts = []
+    if users > 1:
+        for i in range(users if users > 2 else 1):
+            a, b = user_ids[i], user_ids[(i + 1) % users]
+            layouts.append(('direct', None, [a, b]))
+    for g in range(groups):
+        layouts.append(('group', f'Grupo {g}', rng.sample(user_ids, min(group_size, users))))
+    
+    chat_rows = []
+    for chat_type, name, members in layouts:
+        pair = Chat.direct_pair(*members) if chat_type == 'direct' else (None, None)
+        chat_rows.append({'type': chat_type, 'name': name, 'created_at': now,
+                          'direct_user_low_id': pair[0], 'direct_user_high_id': pair[1]})
+    _insert(Chat, chat_rows)
+    chat_ids = [row.id for row in db.session.query(Chat.id).order_by(Chat.id)]
+    
+    _insert(ChatParticipant, [{'chat_id': chat_id, 'user_id': user_id, 'joined_at': now}
+                              for chat_id, (_, _, members) in zip(chat_ids, layouts) for user_id in members])
+    
+    # History: oldest first, authors rotating through the members
+    start = now - timedelta(minutes=messages_per_chat)
+    message_rows = []
+    for chat_id, (_, _, members) in zip(chat_ids, layouts):
+        for n in range(messages_per_chat):
+            message_rows.append({
+                'chat_id': chat_id,
+                'user_id': members[n % len(members)],
+                'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))),
+                'message_type': 'text',
+                'created_at': start + timedelta(minutes=n)
+            })
+    _insert(Message, message_rows)
+    
+    newest = select(func.max(Message.id)).where(Message.chat_id == Chat.id).scalar_subquery()
+    Chat.query.update({Chat.last_message_id: newest}, synchronize_session=False)
+    db.session.commit()
+    
+    chats_by_user = {user_id: [] for user_id in user_ids}
+    direct, group_chats = [], []
+    for chat_id, (chat_type, _, members) in zip(chat_ids, layouts):
+        for user_id in members:
+            chats_by_user[user_id].append(chat_id)
+        if chat_type == 'direct':
+            direct.append((chat_id, members[0], members[1]))
+        else:
+            group_chats.append((chat_id, members))
+    
+    return {
+        'users': [(user_id, f'user{i}') for i, user_id in enumerate(user_ids)],
+        'direct': direct,
+        'groups': group_chats,
+        'chats_by_user': chats_by_user,
+        'stats': {
+            'users': len(user_ids),
+            'chats': len(chat_ids),
+            'messages': len(message_rows),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+    }
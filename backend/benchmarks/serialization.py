@@ -0,0 +1,139 @@
+"""Bytes on the wire and encode/decode CPU per Socket.IO serializer
+
+Encodes representative event payloads (built with the app's own
+serializers) into complete Socket.IO packets, the way the server sends
+them, for every serializer and timestamp format:
+
+    cd backend
+    python -m benchmarks.serialization --output serialization.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from socketio import packet
+from app.fast_json import OrjsonSocketJSON, orjson
+from app.serializers import serialize_message
+from app.timestamps import configure_timestamps, format_timestamp
+
+try:
+    from socketio.msgpack_packet import MsgPackPacket
+except ImportError:  # msgpack is only needed for SOCKETIO_SERIALIZER=msgpack
+    MsgPackPacket = None
+
+class OrjsonPacket(packet.Packet):
+    json = OrjsonSocketJSON
+
+def _serializers():
+    serializers = {'json': packet.Packet}
+    if orjson is not None:
+        serializers['json (orjson)'] = OrjsonPacket
+    if MsgPackPacket is not None:
+        serializers['msgpack'] = MsgPackPacket
+    return serializers
+
+def _sdp(media=('audio', 'video'), candidates=6):
+    """A browser-like offer: codecs, extensions, fingerprints and candidates per m-line"""
+    lines = ['v=0', 'o=- 4611731400430051336 2 IN IP4 127.0.0.1', 's=-', 't=0 0',
+             'a=group:BUNDLE ' + ' '.join(str(i) for i in range(len(media))),
+             'a=extmap-allow-mixed', 'a=msid-semantic: WMS stream']
+    for index, kind in enumerate(media):
+        payloads = list(range(96, 96 + (16 if kind == 'video' else 6)))
+        lines += [f'm={kind} 9 UDP/TLS/RTP/SAVPF ' + ' '.join(map(str, payloads)), 'c=IN IP4 0.0.0.0',
+                  'a=rtcp:9 IN IP4 0.0.0.0', 'a=ice-ufrag:Gx3q', 'a=ice-pwd:Rqz7c9+JQ2v0bIxFqL8z0Wk3',
+                  'a=ice-options:trickle',
+                  'a=fingerprint:sha-256 7B:8B:F0:65:5F:78:E2:51:3B:AC:6F:F3:3F:46:1B:35:DC:B8:5F:64:'
+                  '1A:24:C2:43:F0:A1:58:D0:A1:2C:19:08',
+                  'a=setup:actpass', f'a=mid:{index}', 'a=sendrecv', 'a=rtcp-mux']
+        for n in range(1, 13):
+            lines.append(f'a=extmap:{n} urn:ietf:params:rtp-hdrext:ext-{kind}-{n}')
+        for payload in payloads:
+            codec = 'opus/48000/2' if kind == 'audio' else f'VP{8 + payload % 2}/90000'
+            lines += [f'a=rtpmap:{payload} {codec}', f'a=rtcp-fb:{payload} transport-cc',
+                      f'a=fmtp:{payload} minptime=10;useinbandfec=1;profile-id={payload % 3}']
+        lines += [f'a=ssrc:{1000 + index} cname:4TOk42mSjXCkVIa6', f'a=ssrc:{1000 + index} msid:stream track{index}']
+        for n in range(candidates):
+            lines.append(f'a=candidate:{842163049 + n} 1 udp {2122260223 - n} 192.168.1.{10 + n} '
+                         f'{50000 + n} typ host generation 0 network-id {n + 1}')
+    return '\r\n'.join(lines) + '\r\n'
+
+def _message(message_id, created_at):
+    row = SimpleNamespace(id=message_id, chat_id=42, user_id=7 + message_id % 3, content='¿Nos vemos mañana a las '
+                          f'{message_id % 12 + 8}? Llevo el informe del proyecto.', message_type='text',
+                          file_path=None, created_at=created_at)
+    return serialize_message(row, username=f'user{7 + message_id % 3}')
+
+def payloads():
+    """Return {event name: payload}, built with the current timestamp format"""
+    now = datetime(2026, 5, 4, 12, 30, 15, 123456)
+    candidate = ('candidate:842163049 1 udp 1677729535 203.0.113.7 54321 typ srflx raddr 192.168.1.5 '
+                 'rport 54321 generation 0 ufrag Gx3q network-cost 999')
+    return {
+        'new_message': _message(1000, now),
+        'sync_result (50 messages)': {'chats': {'42': {
+            'messages': [_message(1000 + n, now + timedelta(seconds=n)) for n in range(50)],
+            'truncated': False}}},
+        'chat_added (10 members)': {
+            'id': 42, 'type': 'group', 'name': 'Equipo', 'created_at': format_timestamp(now),
+            'participants': [{'id': n, 'username': f'user{n}', 'email': f'user{n}@example.com',
+                              'created_at': format_timestamp(now - timedelta(days=n))} for n in range(10)]},
+        'call_offer': {'chat_id': 42, 'caller_id': 7, 'offer': {'type': 'offer', 'sdp': _sdp()}},
+        'ice_candidates (8)': {'chat_id': 42, 'sender_id': 7, 'candidates': [
+            {'candidate': candidate, 'sdpMid': '0', 'sdpMLineIndex': 0, 'usernameFragment': 'Gx3q'}
+            for _ in range(8)]}
+    }
+
+def _time_us(func, repeat):
+    samples = []
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        samples.append((time.perf_counter() - started) / repeat * 1e6)
+    return round(statistics.median(samples), 2)
+
+def measure(repeat):
+    results = []
+    for timestamps in ('iso', 'epoch_ms'):
+        configure_timestamps(timestamps)
+        events = payloads()
+        for serializer, packet_class in _serializers().items():
+            for event, payload in events.items():
+                name = event.split(' ')[0]
+                pkt = packet_class(packet_type=packet.EVENT, data=[name, payload], namespace='/')
+                encoded = pkt.encode()
+                size = len(encoded.encode('utf-8') if isinstance(encoded, str) else encoded)
+                results.append({
+                    'event': event,
+                    'serializer': serializer,
+                    'timestamps': timestamps,
+                    'bytes': size,
+                    'encode_us': _time_us(pkt.encode, repeat),
+                    'decode_us': _time_us(lambda: packet_class(encoded_packet=encoded), repeat)
+                })
+    configure_timestamps('iso')
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000, help='encodes/decodes per timing sample')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+    
+    results = measure(args.repeat)
+    for row in results:
+        print(f"{row['event']:<28} {row['serializer']:<14} {row['timestamps']:<9} {row['bytes']:>7} B "
+              f"{row['encode_us']:>8.1f} us enc {row['decode_us']:>8.1f} us dec", file=sys.stderr)
+    
+    encoded = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class QueryCounter:
+    """Counts every statement the app's engine sends to the database"""
+    
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+    
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+class Recorder:
+    """Latency samples grouped by phase and operation
+    
+    A phase is one scenario run on its own (e.g. 'GET /api/chats'); its
+    wall time and the statements issued while it ran give the throughput
+    and queries-per-operation figures. Operations are recorded from any
+    thread, including Socket.IO client callbacks.
+    """
+    
+    def __init__(self, query_counter):
+        self.query_counter = query_counter
+        self.phases = {}
+        self._samples = {}  # {(phase, operation): [seconds]}
+        self._errors = {}  # {(phase, operation): count}
+        self._current = None
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def phase(self, name, primary=None):
+        """Time a phase; queries are divided by the count of its primary operation"""
+        self._current = name
+        queries = self.query_counter.count
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = {
+                'seconds': time.perf_counter() - started,
+                'queries': self.query_counter.count - queries,
+                'primary': primary or name
+            }
+            self._current = None
+    
+    def record(self, operation, seconds, ok=True, phase=None):
+        key = (phase or self._current, operation)
+        with self._lock:
+            if ok:
+                self._samples.setdefault(key, []).append(seconds)
+            else:
+                self._errors[key] = self._errors.get(key, 0) + 1
+    
+    def summary(self):
+        """Return {phase: {'seconds', 'queries', 'operations': {op: stats}}}"""
+        result = {}
+        for name, phase in self.phases.items():
+            operations = {}
+            keys = {key for key in list(self._samples) + list(self._errors) if key[0] == name}
+            for _, operation in sorted(keys):
+                samples = sorted(self._samples.get((name, operation), []))
+                errors = self._errors.get((name, operation), 0)
+                operations[operation] = {
+                    'count': len(samples),
+                    'errors': errors,
+                    'throughput_per_s': round(len(samples) / phase['seconds'], 2) if phase['seconds'] else None,
+                    'latency_ms': _latency_ms(samples)
+                }
+            
+            primary = operations.get(phase['primary'])
+            total = (primary['count'] + primary['errors']) if primary else 0
+            result[name] = {
+                'seconds': round(phase['seconds'], 3),
+                'queries': phase['queries'],
+                'queries_per_op': round(phase['queries'] / total, 2) if total else None,
+                'operations': operations
+            }
+        return result
+
+def _latency_ms(samples):
+    if not samples:
+        return None
+    return {
+        'mean': round(sum(samples) / len(samples) * 1000, 3),
+        'p50': round(percentile(samples, 0.50) * 1000, 3),
+        'p95': round(percentile(samples, 0.95) * 1000, 3),
+        'p99': round(percentile(samples, 0.99) * 1000, 3),
+        'max': round(samples[-1] * 1000, 3)
+    }
@@ -1,7 +1,6 @@
 from app import create_app, socketio
 
-app = create_app()
+app = create_app(debug=__name__ == '__main__')
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
-
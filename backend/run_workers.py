@@ -0,0 +1,78 @@
+"""Run several Socket.IO workers behind a single port
+
+All workers accept connections from one listening socket shared through
+fork, so this launcher needs a platform with fork (Linux/macOS). Workers
+talk to each other through SOCKETIO_MESSAGE_QUEUE and share presence
+through PRESENCE_BACKEND=redis. Because connections are not sticky, clients
+must use the websocket transport (HTTP long-polling needs a sticky proxy).
+
+    SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 python run_workers.py --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+
+def serve(index, count, fd, host, port):
+    # Config reads these at import time, so set them before importing the app
+    os.environ['WORKER_INDEX'] = str(index)
+    os.environ['WORKER_COUNT'] = str(count)
+    
+    from werkzeug.serving import make_server
+    from app import create_app
+    from app.logs import get_logger
+    from app.message_writer import message_writer
+    from app.read_state import read_receipts
+    
+    # The parent's shutdown handler is inherited through fork; exit cleanly instead
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, lambda signum, frame: sys.exit(0))
+    
+    app = create_app()
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    get_logger('workers').info('worker_started', worker=index, pid=os.getpid(), host=host, port=port)
+    try:
+        server.serve_forever()
+    finally:
+        # atexit hooks do not run in multiprocessing children
+        message_writer.stop()
+        read_receipts.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several chat workers on one port')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    
+    if args.workers > 1 and not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+        sys.exit('SOCKETIO_MESSAGE_QUEUE must be set to run more than one worker')
+    if args.workers > 1 and os.getenv('PRESENCE_BACKEND', 'memory') == 'memory':
+        os.environ['PRESENCE_BACKEND'] = 'redis'
+    
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+    
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for index in range(args.workers):
+        worker = context.Process(target=serve, args=(index, args.workers, listener.fileno(), args.host, args.port))
+        worker.start()
+        workers.append(worker)
+    
+    def shutdown(signum, frame):
+        for worker in workers:
+            worker.terminate()
+    
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for worker in workers:
+        worker.join()
+
+if __name__ == '__main__':
+    main()
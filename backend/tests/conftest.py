@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# Config reads the environment at import time, so point it at a scratch
+# SQLite database before the app package is imported
+_workdir = tempfile.mkdtemp(prefix='chat-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_workdir, 'test.db')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_workdir, 'uploads')
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['ARCHIVE_ENABLED'] = 'false'
+os.environ['LOG_LEVEL'] = 'WARNING'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from benchmarks.stats import QueryCounter
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture(scope='session')
+def query_counter(app):
+    counter = QueryCounter()
+    with app.app_context():
+        counter.attach(db.engine)
+    return counter
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
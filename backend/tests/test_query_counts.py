@@ -0,0 +1,69 @@
+"""Listing endpoints must issue a fixed number of statements, whatever the page size"""
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+from app import db
+from app.models import Chat, ChatParticipant, Message, User
+
+def _user(name):
+    user = User(username=name, email=f'{name}@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+def _group(name, members, messages_per_member=0):
+    chat = Chat(type='group', name=name)
+    db.session.add(chat)
+    db.session.flush()
+    db.session.add_all(ChatParticipant(chat_id=chat.id, user_id=member.id) for member in members)
+    rows = [{'chat_id': chat.id, 'user_id': member.id, 'content': f'{member.username} {i}', 'message_type': 'text'}
+            for i in range(messages_per_member) for member in members]
+    if rows:
+        db.session.execute(insert(Message), rows)
+    chat.last_message_id = db.session.query(db.func.max(Message.id)).filter(Message.chat_id == chat.id).scalar()
+    return chat
+
+def _statements(client, query_counter, url, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get(url, headers=headers)  # warm the membership and directory caches
+    before = query_counter.count
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return query_counter.count - before, response.get_json()
+
+def test_get_messages_statements_do_not_grow_with_page_size(app, client, query_counter):
+    with app.app_context():
+        members = [_user(f'pager{i}') for i in range(8)]
+        chat = _group('history', members, messages_per_member=25)
+        db.session.commit()
+        chat_id = chat.id
+        token = create_access_token(identity=members[0].id)
+    
+    small, small_page = _statements(client, query_counter, f'/api/chats/{chat_id}/messages?limit=5', token)
+    large, large_page = _statements(client, query_counter, f'/api/chats/{chat_id}/messages?limit=150', token)
+    assert len(small_page['messages']) == 5
+    assert len(large_page['messages']) == 150
+    assert large == small, (small, large)
+    assert small > 0
+    
+    # Older pages through the keyset cursor cost the same
+    cursor = large_page['next_cursor']
+    older, _ = _statements(client, query_counter, f'/api/chats/{chat_id}/messages?limit=150&before_id={cursor}', token)
+    assert older == small
+
+def test_get_chats_statements_do_not_grow_with_chat_count(app, client, query_counter):
+    with app.app_context():
+        few_owner, many_owner = _user('few_chats'), _user('many_chats')
+        others = [_user(f'member{i}') for i in range(4)]
+        for i in range(2):
+            _group(f'few {i}', [few_owner] + others, messages_per_member=2)
+        for i in range(20):
+            _group(f'many {i}', [many_owner] + others, messages_per_member=2)
+        db.session.commit()
+        few_token = create_access_token(identity=few_owner.id)
+        many_token = create_access_token(identity=many_owner.id)
+    
+    few, few_page = _statements(client, query_counter, '/api/chats', few_token)
+    many, many_page = _statements(client, query_counter, '/api/chats', many_token)
+    assert len(few_page['chats']) == 2
+    assert len(many_page['chats']) == 20
+    assert many == few, (few, many)
@@ -3,4 +3,6 @@
 // Para encontrar tu IP: Windows: ipconfig | Linux/Mac: ifconfig
 export const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000'
 export const SOCKET_URL = import.meta.env.VITE_SOCKET_URL || 'http://localhost:5000'
+// Debe coincidir con SOCKETIO_SERIALIZER del backend: 'json' o 'msgpack'
+export const SOCKET_SERIALIZER = import.meta.env.VITE_SOCKET_SERIALIZER || 'json'
 
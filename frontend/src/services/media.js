@@ -0,0 +1,52 @@
+import api from './api'
+
+// Previews are fetched through the API client (so they carry the JWT) and
+// kept as object URLs; the oldest are released past this many
+const MAX_CACHED_PREVIEWS = 500
+const PENDING_RETRIES = 5
+
+const cache = new Map() // preview_url -> Promise<object URL | null>
+
+function sleep(ms) {
+  return new Promise(resolve => setTimeout(resolve, ms))
+}
+
+async function fetchPreview(previewUrl) {
+  // preview_url is '/api/files/<name>/preview'; the client's baseURL already ends in /api
+  const path = previewUrl.replace(/^\/api/, '')
+  for (let attempt = 0; attempt <= PENDING_RETRIES; attempt++) {
+    const response = await api.get(path, {
+      responseType: 'blob',
+      validateStatus: status => status === 200 || status === 202
+    })
+    if (response.status === 200) {
+      return URL.createObjectURL(response.data)
+    }
+    // 202: generated in the background, ask again after the hinted delay
+    const retryAfter = Number(response.headers['retry-after']) || 1
+    await sleep(retryAfter * 1000 * (attempt + 1))
+  }
+  return null
+}
+
+export function loadPreview(previewUrl) {
+  if (cache.has(previewUrl)) {
+    return cache.get(previewUrl)
+  }
+
+  const pending = fetchPreview(previewUrl).catch(() => null)
+  cache.set(previewUrl, pending)
+  // Failures are not cached, so a later call asks again
+  pending.then(objectUrl => {
+    if (!objectUrl && cache.get(previewUrl) === pending) {
+      cache.delete(previewUrl)
+    }
+  })
+
+  if (cache.size > MAX_CACHED_PREVIEWS) {
+    const [oldestUrl, oldest] = cache.entries().next().value
+    cache.delete(oldestUrl)
+    oldest.then(objectUrl => objectUrl && URL.revokeObjectURL(objectUrl))
+  }
+  return pending
+}
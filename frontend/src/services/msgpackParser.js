@@ -0,0 +1,289 @@
+// Socket.IO parser that sends each packet as one MessagePack frame, matching
+// python-socketio's msgpack serializer ({ type, data, nsp, id }). Kept in-tree
+// so the binary transport needs no extra npm dependency.
+
+export const protocol = 5
+
+export const PacketType = {
+  CONNECT: 0,
+  DISCONNECT: 1,
+  EVENT: 2,
+  ACK: 3,
+  CONNECT_ERROR: 4
+}
+
+const textEncoder = new TextEncoder()
+const textDecoder = new TextDecoder()
+
+// ---- Encoding ----
+
+class Writer {
+  constructor() {
+    this.buffer = new Uint8Array(256)
+    this.view = new DataView(this.buffer.buffer)
+    this.length = 0
+  }
+
+  reserve(size) {
+    if (this.length + size <= this.buffer.length) return
+    let capacity = this.buffer.length * 2
+    while (capacity < this.length + size) capacity *= 2
+    const buffer = new Uint8Array(capacity)
+    buffer.set(this.buffer.subarray(0, this.length))
+    this.buffer = buffer
+    this.view = new DataView(buffer.buffer)
+  }
+
+  u8(value) {
+    this.reserve(1)
+    this.view.setUint8(this.length, value)
+    this.length += 1
+  }
+
+  u16(value) {
+    this.reserve(2)
+    this.view.setUint16(this.length, value)
+    this.length += 2
+  }
+
+  u32(value) {
+    this.reserve(4)
+    this.view.setUint32(this.length, value)
+    this.length += 4
+  }
+
+  bytes(bytes) {
+    this.reserve(bytes.length)
+    this.buffer.set(bytes, this.length)
+    this.length += bytes.length
+  }
+
+  header(size, fix, fixLimit, small, medium, large) {
+    if (fix !== null && size < fixLimit) {
+      this.u8(fix | size)
+    } else if (small !== null && size < 0x100) {
+      this.u8(small)
+      this.u8(size)
+    } else if (size < 0x10000) {
+      this.u8(medium)
+      this.u16(size)
+    } else {
+      this.u8(large)
+      this.u32(size)
+    }
+  }
+
+  number(value) {
+    if (Number.isInteger(value) && Math.abs(value) <= Number.MAX_SAFE_INTEGER) {
+      if (value >= 0) {
+        if (value < 0x80) return this.u8(value)
+        if (value < 0x100) { this.u8(0xcc); return this.u8(value) }
+        if (value < 0x10000) { this.u8(0xcd); return this.u16(value) }
+        if (value < 0x100000000) { this.u8(0xce); return this.u32(value) }
+        this.u8(0xcf)
+        this.u32(Math.floor(value / 0x100000000))
+        return this.u32(value >>> 0)
+      }
+      if (value >= -0x20) return this.u8(value & 0xff)
+      if (value >= -0x80) { this.u8(0xd0); this.reserve(1); this.view.setInt8(this.length, value); this.length += 1; return }
+      if (value >= -0x8000) { this.u8(0xd1); this.reserve(2); this.view.setInt16(this.length, value); this.length += 2; return }
+      if (value >= -0x80000000) { this.u8(0xd2); this.reserve(4); this.view.setInt32(this.length, value); this.length += 4; return }
+      this.u8(0xd3)
+      this.reserve(8)
+      this.view.setBigInt64(this.length, BigInt(value))
+      this.length += 8
+      return
+    }
+    this.u8(0xcb)
+    this.reserve(8)
+    this.view.setFloat64(this.length, value)
+    this.length += 8
+  }
+
+  value(value) {
+    if (value === null || value === undefined) return this.u8(0xc0)
+    if (value === false) return this.u8(0xc2)
+    if (value === true) return this.u8(0xc3)
+    if (typeof value === 'number') return this.number(value)
+    if (typeof value === 'string') {
+      const bytes = textEncoder.encode(value)
+      this.header(bytes.length, 0xa0, 32, 0xd9, 0xda, 0xdb)
+      return this.bytes(bytes)
+    }
+    if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+      const bytes = value instanceof ArrayBuffer
+        ? new Uint8Array(value)
+        : new Uint8Array(value.buffer, value.byteOffset, value.byteLength)
+      this.header(bytes.length, null, 0, 0xc4, 0xc5, 0xc6)
+      return this.bytes(bytes)
+    }
+    if (Array.isArray(value)) {
+      this.header(value.length, 0x90, 16, null, 0xdc, 0xdd)
+      for (const item of value) this.value(item)
+      return
+    }
+    if (typeof value.toJSON === 'function') return this.value(value.toJSON())
+    const keys = Object.keys(value).filter(key => value[key] !== undefined)
+    this.header(keys.length, 0x80, 16, null, 0xde, 0xdf)
+    for (const key of keys) {
+      this.value(key)
+      this.value(value[key])
+    }
+  }
+}
+
+export function encode(value) {
+  const writer = new Writer()
+  writer.value(value)
+  return writer.buffer.slice(0, writer.length)
+}
+
+// ---- Decoding ----
+
+class Reader {
+  constructor(bytes) {
+    this.bytes = bytes
+    this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+    this.offset = 0
+  }
+
+  advance(size) {
+    const offset = this.offset
+    if (offset + size > this.bytes.length) throw new Error('msgpack: unexpected end of data')
+    this.offset += size
+    return offset
+  }
+
+  string(size) {
+    const offset = this.advance(size)
+    return textDecoder.decode(this.bytes.subarray(offset, offset + size))
+  }
+
+  binary(size) {
+    const offset = this.advance(size)
+    return this.bytes.slice(offset, offset + size).buffer
+  }
+
+  array(size) {
+    const items = new Array(size)
+    for (let i = 0; i < size; i++) items[i] = this.value()
+    return items
+  }
+
+  map(size) {
+    const object = {}
+    for (let i = 0; i < size; i++) {
+      const key = this.value()
+      object[key] = this.value()
+    }
+    return object
+  }
+
+  value() {
+    const view = this.view
+    const type = view.getUint8(this.advance(1))
+    if (type < 0x80) return type
+    if (type < 0x90) return this.map(type & 0x0f)
+    if (type < 0xa0) return this.array(type & 0x0f)
+    if (type < 0xc0) return this.string(type & 0x1f)
+    if (type >= 0xe0) return type - 0x100
+    switch (type) {
+      case 0xc0: return null
+      case 0xc2: return false
+      case 0xc3: return true
+      case 0xc4: return this.binary(view.getUint8(this.advance(1)))
+      case 0xc5: return this.binary(view.getUint16(this.advance(2)))
+      case 0xc6: return this.binary(view.getUint32(this.advance(4)))
+      case 0xca: return view.getFloat32(this.advance(4))
+      case 0xcb: return view.getFloat64(this.advance(8))
+      case 0xcc: return view.getUint8(this.advance(1))
+      case 0xcd: return view.getUint16(this.advance(2))
+      case 0xce: return view.getUint32(this.advance(4))
+      case 0xcf: return Number(view.getBigUint64(this.advance(8)))
+      case 0xd0: return view.getInt8(this.advance(1))
+      case 0xd1: return view.getInt16(this.advance(2))
+      case 0xd2: return view.getInt32(this.advance(4))
+      case 0xd3: return Number(view.getBigInt64(this.advance(8)))
+      case 0xd9: return this.string(view.getUint8(this.advance(1)))
+      case 0xda: return this.string(view.getUint16(this.advance(2)))
+      case 0xdb: return this.string(view.getUint32(this.advance(4)))
+      case 0xdc: return this.array(view.getUint16(this.advance(2)))
+      case 0xdd: return this.array(view.getUint32(this.advance(4)))
+      case 0xde: return this.map(view.getUint16(this.advance(2)))
+      case 0xdf: return this.map(view.getUint32(this.advance(4)))
+      default: throw new Error(`msgpack: unsupported type 0x${type.toString(16)}`)
+    }
+  }
+}
+
+export function decode(data) {
+  const bytes = data instanceof ArrayBuffer ? new Uint8Array(data) : new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+  const reader = new Reader(bytes)
+  const value = reader.value()
+  if (reader.offset !== bytes.length) throw new Error('msgpack: trailing bytes')
+  return value
+}
+
+// ---- Socket.IO parser interface ----
+
+function isValidPacket(packet) {
+  if (!packet || typeof packet !== 'object' || typeof packet.nsp !== 'string') return false
+  if (packet.id !== undefined && !Number.isInteger(packet.id)) return false
+  switch (packet.type) {
+    case PacketType.CONNECT:
+      return packet.data === undefined || (typeof packet.data === 'object' && packet.data !== null)
+    case PacketType.DISCONNECT:
+      return packet.data === undefined || packet.data === null
+    case PacketType.CONNECT_ERROR:
+      return typeof packet.data === 'string' || (typeof packet.data === 'object' && packet.data !== null)
+    case PacketType.EVENT:
+    case PacketType.ACK:
+      return Array.isArray(packet.data)
+    default:
+      return false
+  }
+}
+
+export class Encoder {
+  encode(packet) {
+    return [encode(packet)]
+  }
+}
+
+export class Decoder {
+  constructor() {
+    this.listeners = {}
+  }
+
+  add(chunk) {
+    const packet = decode(chunk)
+    // python-socketio sends id/data as nil when absent
+    if (packet.id === null) delete packet.id
+    if (packet.data === null && packet.type !== PacketType.DISCONNECT) delete packet.data
+    if (!isValidPacket(packet)) throw new Error('invalid msgpack packet')
+    this.emitReserved('decoded', packet)
+  }
+
+  destroy() {}
+
+  on(event, listener) {
+    (this.listeners[event] ||= []).push(listener)
+    return this
+  }
+
+  off(event, listener) {
+    if (!event) {
+      this.listeners = {}
+    } else if (!listener) {
+      delete this.listeners[event]
+    } else {
+      this.listeners[event] = (this.listeners[event] || []).filter(l => l !== listener)
+    }
+    return this
+  }
+
+  emitReserved(event, ...args) {
+    for (const listener of [...(this.listeners[event] || [])]) listener(...args)
+    return this
+  }
+}
@@ -1,10 +1,13 @@
 import { io } from 'socket.io-client'
-import { SOCKET_URL } from '../config'
+import * as msgpackParser from './msgpackParser'
+import { SOCKET_URL, SOCKET_SERIALIZER } from '../config'
 
 class SocketService {
   constructor() {
     this.socket = null
     this.connected = false
+    // Events the server asked us to slow down on: event -> time when they may be sent again
+    this.blockedUntil = new Map()
   }
 
   connect(token) {
@@ -12,10 +15,16 @@ class SocketService {
       return this.socket
     }
 
-    this.socket = io(SOCKET_URL, {
+    const options = {
       auth: { token },
       transports: ['websocket', 'polling']
-    })
+    }
+    // Binary packets must be decoded the same way the server encodes them
+    if (SOCKET_SERIALIZER === 'msgpack') {
+      options.parser = msgpackParser
+    }
+
+    this.socket = io(SOCKET_URL, options)
 
     this.socket.on('connect', () => {
       this.connected = true
@@ -31,6 +40,17 @@ class SocketService {
       console.error('Socket connection error:', error)
     })
 
+    this.socket.on('error', (error) => {
+      if (error?.retry && error.event && error.retry_after) {
+        this.blockedUntil.set(error.event, Date.now() + error.retry_after * 1000)
+        console.warn(`Server busy on ${error.event} (${error.code}), retrying after ${error.retry_after}s`)
+        // Rejected messages come back in the error; emit() holds them until the hinted time
+        if (error.data) {
+          this.emit(error.event, error.data)
+        }
+      }
+    })
+
     return this.socket
   }
 
@@ -44,6 +64,12 @@ class SocketService {
 
   emit(event, data) {
     if (this.socket && this.connected) {
+      // Hold events the server is rate limiting until the hinted time
+      const wait = (this.blockedUntil.get(event) || 0) - Date.now()
+      if (wait > 0) {
+        setTimeout(() => this.emit(event, data), wait)
+        return
+      }
       this.socket.emit(event, data)
     }
   }
@@ -61,8 +87,7 @@ class SocketService {
   }
 
   joinChat(chatId) {
-    const token = localStorage.getItem('token')
-    this.emit('join_chat', { token, chat_id: chatId })
+    this.emit('join_chat', { chat_id: chatId })
   }
 
   leaveChat(chatId) {
@@ -70,9 +95,7 @@ class SocketService {
   }
 
   sendMessage(chatId, content, messageType = 'text', filePath = null) {
-    const token = localStorage.getItem('token')
     this.emit('send_message', {
-      token,
       chat_id: chatId,
       content,
       message_type: messageType,
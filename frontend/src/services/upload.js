@@ -0,0 +1,44 @@
+import api from './api'
+
+// Files above this size go through the resumable chunked upload API
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+
+async function uploadChunked(file) {
+  const init = await api.post('/uploads', { filename: file.name, size: file.size })
+  const { upload_id: uploadId, chunk_size: chunkSize } = init.data
+  let offset = init.data.offset
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + chunkSize)
+    try {
+      const response = await api.put(`/uploads/${uploadId}`, chunk, {
+        params: { offset },
+        headers: { 'Content-Type': 'application/octet-stream' }
+      })
+      offset = response.data.offset
+    } catch (error) {
+      // Resume from whatever the server actually received
+      const status = await api.get(`/uploads/${uploadId}`)
+      if (status.data.offset === offset) throw error
+      offset = status.data.offset
+    }
+  }
+
+  const response = await api.post(`/uploads/${uploadId}/complete`)
+  return response.data
+}
+
+export async function uploadFile(file, filename = file.name) {
+  if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+    return uploadChunked(new File([file], filename, { type: file.type }))
+  }
+
+  const formData = new FormData()
+  formData.append('file', file, filename)
+  const response = await api.post('/upload', formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data'
+    }
+  })
+  return response.data
+}
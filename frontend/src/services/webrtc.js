@@ -5,6 +5,9 @@ class WebRTCService {
     this.peerConnections = new Map()
     this.socketService = null
     this.onRemoteStream = null
+    // Outgoing ICE candidates waiting to be sent, keyed by target user
+    this.pendingCandidates = new Map()
+    this.candidateFlushTimer = null
   }
 
   setSocketService(socketService) {
@@ -77,13 +80,7 @@ class WebRTCService {
     // Handle ICE candidates
     pc.onicecandidate = (event) => {
       if (event.candidate && this.socketService) {
-        const token = localStorage.getItem('token')
-        this.socketService.emit('ice_candidate', {
-          token,
-          chat_id: chatId,
-          target_id: userId,
-          candidate: event.candidate
-        })
+        this.queueIceCandidate(chatId, userId, event.candidate)
       }
     }
 
@@ -99,6 +96,29 @@ class WebRTCService {
     return pc
   }
 
+  queueIceCandidate(chatId, targetId, candidate) {
+    // Candidates trickle in quickly during setup; send each burst as one packet
+    const key = `${chatId}:${targetId}`
+    if (!this.pendingCandidates.has(key)) {
+      this.pendingCandidates.set(key, { chat_id: chatId, target_id: targetId, candidates: [] })
+    }
+    this.pendingCandidates.get(key).candidates.push(candidate.toJSON ? candidate.toJSON() : candidate)
+    if (!this.candidateFlushTimer) {
+      this.candidateFlushTimer = setTimeout(() => this.flushIceCandidates(), 20)
+    }
+  }
+
+  flushIceCandidates() {
+    clearTimeout(this.candidateFlushTimer)
+    this.candidateFlushTimer = null
+    if (this.socketService) {
+      this.pendingCandidates.forEach(batch => {
+        this.socketService.emit('ice_candidates', batch)
+      })
+    }
+    this.pendingCandidates.clear()
+  }
+
   async createOffer(userId, chatId) {
     const pc = this.createPeerConnection(userId, chatId)
     const offer = await pc.createOffer()
@@ -128,6 +148,15 @@ class WebRTCService {
     }
   }
 
+  async handleIceCandidates(candidates, userId) {
+    const pc = this.peerConnections.get(userId)
+    if (pc) {
+      for (const candidate of candidates) {
+        await pc.addIceCandidate(new RTCIceCandidate(candidate))
+      }
+    }
+  }
+
   closePeerConnection(userId) {
     const pc = this.peerConnections.get(userId)
     if (pc) {
@@ -141,6 +170,9 @@ class WebRTCService {
     this.peerConnections.forEach((pc, userId) => {
       this.closePeerConnection(userId)
     })
+    clearTimeout(this.candidateFlushTimer)
+    this.candidateFlushTimer = null
+    this.pendingCandidates.clear()
     this.stopLocalStream()
   }
 
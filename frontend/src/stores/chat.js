@@ -2,11 +2,15 @@ import { defineStore } from 'pinia'
 import { ref } from 'vue'
 import api from '../services/api'
 import socketService from '../services/socket'
+import { useAuthStore } from './auth'
 
 export const useChatStore = defineStore('chat', () => {
   const chats = ref([])
   const currentChat = ref(null)
   const messages = ref([])
+  const messagesCursor = ref(null)
+  const hasMoreMessages = ref(false)
+  const loadingOlderMessages = ref(false)
   const onlineUsers = ref(new Set())
 
   function setChats(newChats) {
@@ -23,17 +27,70 @@ export const useChatStore = defineStore('chat', () => {
   function setCurrentChat(chat) {
     currentChat.value = chat
     if (chat) {
-      socketService.joinChat(chat.id)
-      loadMessages(chat.id)
+      chat.unread_count = 0
+      loadMessages(chat.id).then(() => {
+        const last = messages.value[messages.value.length - 1]
+        if (last && currentChat.value?.id === chat.id) markRead(chat.id, last.id)
+      })
     }
   }
 
+  // The server coalesces these, so it is fine to send one per message seen
+  function markRead(chatId, messageId) {
+    socketService.emit('mark_read', { chat_id: chatId, message_id: messageId })
+  }
+
   function addMessage(message) {
+    const chat = chats.value.find(c => c.id === message.chat_id)
+    // Replayed messages after a reconnect may already have arrived live
+    if (chat && !(chat.last_message && message.id <= chat.last_message.id)) {
+      chat.last_message = message
+      const ownMessage = message.user_id === useAuthStore().user?.id
+      if (message.chat_id !== currentChat.value?.id && !ownMessage) {
+        chat.unread_count = (chat.unread_count || 0) + 1
+      }
+    }
     if (message.chat_id === currentChat.value?.id) {
-      messages.value.push(message)
+      const last = messages.value[messages.value.length - 1]
+      if (!last || message.id > last.id) {
+        messages.value.push(message)
+        if (message.user_id !== useAuthStore().user?.id) markRead(message.chat_id, message.id)
+      } else if (!messages.value.some(m => m.id === message.id)) {
+        const index = messages.value.findIndex(m => m.id > message.id)
+        messages.value.splice(index, 0, message)
+      }
     }
   }
 
+  // Newest message id we hold for every chat, sent to the server on reconnect
+  function lastSeenIds() {
+    const lastSeen = {}
+    chats.value.forEach(chat => {
+      lastSeen[chat.id] = chat.last_message?.id || 0
+    })
+    const last = messages.value[messages.value.length - 1]
+    if (currentChat.value && last && last.id > (lastSeen[currentChat.value.id] || 0)) {
+      lastSeen[currentChat.value.id] = last.id
+    }
+    return lastSeen
+  }
+
+  function applySync(result) {
+    Object.entries(result.chats).forEach(([chatId, delta]) => {
+      chatId = Number(chatId)
+      if (delta.truncated && chatId === currentChat.value?.id) {
+        // Missed too much to patch in place; fetch the newest page instead
+        loadMessages(chatId)
+        const chat = chats.value.find(c => c.id === chatId)
+        if (chat && delta.messages.length) {
+          chat.last_message = delta.messages[delta.messages.length - 1]
+        }
+        return
+      }
+      delta.messages.forEach(addMessage)
+    })
+  }
+
   function setMessages(newMessages) {
     messages.value = newMessages
   }
@@ -49,13 +106,37 @@ export const useChatStore = defineStore('chat', () => {
 
   async function loadMessages(chatId) {
     try {
+      // Newest page only; older history is fetched on demand
       const response = await api.get(`/chats/${chatId}/messages`)
       messages.value = response.data.messages
+      messagesCursor.value = response.data.next_cursor
+      hasMoreMessages.value = response.data.has_more
     } catch (error) {
       console.error('Error loading messages:', error)
     }
   }
 
+  async function loadOlderMessages() {
+    const chatId = currentChat.value?.id
+    if (!chatId || !hasMoreMessages.value || loadingOlderMessages.value) return
+
+    loadingOlderMessages.value = true
+    try {
+      const response = await api.get(`/chats/${chatId}/messages`, {
+        params: { before_id: messagesCursor.value }
+      })
+      // Ignore the page if the user switched chats meanwhile
+      if (currentChat.value?.id !== chatId) return
+      messages.value = [...response.data.messages, ...messages.value]
+      messagesCursor.value = response.data.next_cursor
+      hasMoreMessages.value = response.data.has_more
+    } catch (error) {
+      console.error('Error loading older messages:', error)
+    } finally {
+      loadingOlderMessages.value = false
+    }
+  }
+
   async function createChat(type, name = null, participantIds = []) {
     try {
       const response = await api.post('/chats', {
@@ -64,6 +145,8 @@ export const useChatStore = defineStore('chat', () => {
         participant_ids: participantIds
       })
       addChat(response.data.chat)
+      // New contacts may already be online
+      socketService.emit('get_online_users', {})
       return { success: true, chat: response.data.chat }
     } catch (error) {
       return { 
@@ -114,12 +197,37 @@ export const useChatStore = defineStore('chat', () => {
       addMessage(message)
     })
 
-    socketService.on('user_online', (data) => {
-      addOnlineUser(data.user_id)
+    // After a dropped connection ask only for what we missed
+    let connectedBefore = socketService.connected
+    socketService.on('connect', () => {
+      if (connectedBefore) {
+        socketService.emit('sync', { chats: lastSeenIds() })
+      }
+      connectedBefore = true
+    })
+
+    socketService.on('sync_result', (result) => {
+      applySync(result)
+    })
+
+    // Our read marker moved, possibly from another device
+    socketService.on('read_receipt', (receipt) => {
+      if (receipt.user_id !== useAuthStore().user?.id) return
+      const chat = chats.value.find(c => c.id === receipt.chat_id)
+      if (chat && receipt.message_id >= (chat.last_message?.id || 0)) {
+        chat.unread_count = 0
+      }
+    })
+
+    // The server joins us to new chats' rooms; just list them
+    socketService.on('chat_added', (chat) => {
+      addChat(chat)
     })
 
-    socketService.on('user_offline', (data) => {
-      removeOnlineUser(data.user_id)
+    // Coalesced presence changes for users we share a chat with
+    socketService.on('presence_update', (data) => {
+      data.online.forEach(addOnlineUser)
+      data.offline.forEach(removeOnlineUser)
     })
 
     socketService.on('online_users', (data) => {
@@ -131,6 +239,8 @@ export const useChatStore = defineStore('chat', () => {
     chats,
     currentChat,
     messages,
+    hasMoreMessages,
+    loadingOlderMessages,
     onlineUsers,
     setChats,
     addChat,
@@ -139,6 +249,8 @@ export const useChatStore = defineStore('chat', () => {
     setMessages,
     loadChats,
     loadMessages,
+    loadOlderMessages,
+    markRead,
     createChat,
     sendMessage,
     setOnlineUsers,
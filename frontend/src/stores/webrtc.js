@@ -2,6 +2,7 @@ import { defineStore } from 'pinia'
 import { ref } from 'vue'
 import webrtcService from '../services/webrtc'
 import socketService from '../services/socket'
+import { useAuthStore } from './auth'
 
 export const useWebRTCStore = defineStore('webrtc', () => {
   const inCall = ref(false)
@@ -29,9 +30,7 @@ export const useWebRTCStore = defineStore('webrtc', () => {
       if (isInitiator) {
         // Create offer for all participants
         const offer = await webrtcService.createOffer(null, chatId)
-        const token = localStorage.getItem('token')
         socketService.emit('call_offer', {
-          token,
           chat_id: chatId,
           offer
         })
@@ -56,9 +55,7 @@ export const useWebRTCStore = defineStore('webrtc', () => {
       // Handle offer and create answer
       const answer = await webrtcService.handleOffer(offer, callerId, chatId)
       
-      const token = localStorage.getItem('token')
       socketService.emit('call_answer', {
-        token,
         chat_id: chatId,
         caller_id: callerId,
         answer
@@ -83,9 +80,7 @@ export const useWebRTCStore = defineStore('webrtc', () => {
     screenSharing.value = false
     
     if (chatId) {
-      const token = localStorage.getItem('token')
       socketService.emit('call_end', {
-        token,
         chat_id: chatId
       })
     }
@@ -160,6 +155,9 @@ export const useWebRTCStore = defineStore('webrtc', () => {
   function setupSocketListeners() {
     socketService.on('call_offer', async (data) => {
       const { chat_id, caller_id, offer } = data
+      // The offer goes to the whole call room, which includes the caller's other devices
+      const authStore = useAuthStore()
+      if (caller_id === authStore.user?.id) return
       // Show call notification (you can emit an event or use a notification system)
       // For now, we'll auto-answer (you might want to add a UI for this)
       await answerCall(chat_id, caller_id, offer)
@@ -171,9 +169,9 @@ export const useWebRTCStore = defineStore('webrtc', () => {
       // The remote stream will be added via webrtcService's ontrack handler
     })
 
-    socketService.on('ice_candidate', async (data) => {
-      const { sender_id, candidate } = data
-      await webrtcService.handleIceCandidate(candidate, sender_id)
+    socketService.on('ice_candidates', async (data) => {
+      const { sender_id, candidates } = data
+      await webrtcService.handleIceCandidates(candidates, sender_id)
     })
 
     socketService.on('call_end', () => {